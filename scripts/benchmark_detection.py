@@ -0,0 +1,80 @@
+"""
+Compare card detection scale policies on the sample photos.
+
+Every photo in samples/ (kessig.JPG, box.jpg, frame.jpg by default) is also
+resized to each --sides long side, so the policies see webcam to DSLR sizes.
+
+    fixed      the old fixed 0.25 downscale
+    adaptive   rotateCrop.detectionScale from the input size, no fallback
+    pyramid    adaptive, then the coarse-to-fine fallback (rotateCrop.detectCards)
+
+Reports, per policy, how many inputs had a card detected and the latency, then
+the scale picked and the time per input.
+
+    python scripts/benchmark_detection.py --repeat 5
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from rotateCrop import detectCards, detectionScale  # noqa: E402
+
+POLICIES = {
+    "fixed": lambda img: detectCards(img, scale=.25),
+    "adaptive": lambda img: detectCards(img, scale=detectionScale(img.shape)),
+    "pyramid": lambda img: detectCards(img),
+}
+
+
+def inputs(names, sides):
+    for name in names:
+        img = cv2.imread(str(ROOT / "samples" / name))
+        if img is None:
+            print(f"Skipping {name}, could not read it")
+            continue
+        yield f"{name} {img.shape[1]}x{img.shape[0]}", img
+        for side in sides:
+            scale = side / max(img.shape[:2])
+            resized = cv2.resize(img, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+            yield f"{name} {resized.shape[1]}x{resized.shape[0]}", resized
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="+", default=["kessig.JPG", "box.jpg", "frame.jpg"])
+    parser.add_argument("--sides", nargs="*", type=int, default=[640, 1600, 4000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for label, img in inputs(args.images, args.sides):
+        for policy, detect in POLICIES.items():
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                detection = detect(img)
+                times.append(time.perf_counter() - start)
+            rows.append((policy, label, detection, float(np.median(times))))
+
+    print(f"{'policy':>10} {'detected':>9} {'mean ms':>8} {'max ms':>8}")
+    for policy in POLICIES:
+        results = [r for r in rows if r[0] == policy]
+        found = sum(bool(r[2].contours) for r in results)
+        times = [1e3 * r[3] for r in results]
+        print(f"{policy:>10} {found:>4}/{len(results):<4} {np.mean(times):>8.1f} {np.max(times):>8.1f}")
+
+    print(f"\n{'input':>26} {'policy':>10} {'cards':>5} {'scale':>6} {'tries':>5} {'ms':>7}")
+    for policy, label, detection, seconds in rows:
+        print(f"{label:>26} {policy:>10} {len(detection.contours):>5} {detection.scale:>6.3f} "
+              f"{len(detection.attempts):>5} {1e3 * seconds:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Recall against latency of the art embedding matcher next to the hash search.
+
+The corpus is --corpus synthetic art crops: random zoomed, flipped and
+gamma-jittered windows of the images in samples/. The queries are --queries
+degraded copies of corpus crops, with glare, blur, perspective jitter, noise
+and JPEG compression. Each query should find the crop it came from.
+
+Compared: top-k on each hash type alone, the full hash cascade, exact search over the
+embeddings, IVF-PQ at several nprobe, and the two-stage matcher (cascade,
+then art_embedding.merge with IVF-PQ when art_embedding.ambiguous).
+
+    python scripts/benchmark_embedding.py --corpus 10000 --queries 300
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from art_crops import crop_size, HASH_ART_BOX  # noqa: E402
+from art_embedding import EmbeddingIndex, ambiguous, merge  # noqa: E402
+from fast_hash import multi_hash_batch  # noqa: E402
+from hash_cascade import CascadeRanker  # noqa: E402
+from hash_search import HASH_TYPES, HashSearch  # noqa: E402
+
+WIDTH, HEIGHT = crop_size(HASH_ART_BOX)
+
+
+def corpus(count, rng):
+    sources = [cv2.imread(str(p), cv2.IMREAD_GRAYSCALE) for p in sorted(ROOT.glob("samples/*.[jJ][pP][gG]"))]
+    sources = [s for s in sources if s is not None]
+    crops = np.empty((count, HEIGHT, WIDTH), dtype=np.uint8)
+    for i in range(count):
+        source = sources[rng.integers(len(sources))]
+        zoom = rng.uniform(0.15, 1.0)
+        h = int(min(source.shape[0], source.shape[1] * HEIGHT / WIDTH) * zoom)
+        w = int(h * WIDTH / HEIGHT)
+        y, x = rng.integers(0, source.shape[0] - h + 1), rng.integers(0, source.shape[1] - w + 1)
+        crop = cv2.resize(source[y:y + h, x:x + w], (WIDTH, HEIGHT), interpolation=cv2.INTER_AREA)
+        if rng.random() < 0.5:
+            crop = crop[:, ::-1]
+        if rng.random() < 0.5:
+            crop = crop[::-1]
+        gamma = rng.uniform(0.6, 1.6)
+        crops[i] = (255 * (crop / 255.0) ** gamma).astype(np.uint8)
+    return crops
+
+
+def degrade(crop, rng):
+    """Glare, blur, perspective jitter, noise and JPEG compression."""
+    img = crop.astype(np.float32)
+    yy, xx = np.mgrid[:HEIGHT, :WIDTH]
+    cy, cx = rng.uniform(0, HEIGHT), rng.uniform(0, WIDTH)
+    radius = rng.uniform(10, 40)
+    img += rng.uniform(60, 160) * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * radius ** 2))
+    img = cv2.GaussianBlur(img, (0, 0), rng.uniform(0.5, 1.5))
+    corners = np.float32([[0, 0], [WIDTH, 0], [WIDTH, HEIGHT], [0, HEIGHT]])
+    moved = corners + rng.normal(0, 3, size=(4, 2)).astype(np.float32)
+    img = cv2.warpPerspective(img, cv2.getPerspectiveTransform(corners, moved), (WIDTH, HEIGHT),
+                              borderMode=cv2.BORDER_REPLICATE)
+    img += rng.normal(0, 6, size=img.shape)
+    img = img.clip(0, 255).astype(np.uint8)
+    _, data = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 60])
+    return cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+
+
+def evaluate(label, truth, search_one, queries):
+    """Recall@1 and @10 and mean latency of search_one(query index) -> ranked rows."""
+    hits1 = hits10 = 0
+    start = time.perf_counter()
+    for i in range(len(queries)):
+        rows = list(search_one(i))
+        hits1 += bool(rows) and rows[0] == truth[i]
+        hits10 += truth[i] in rows[:10]
+    ms = 1e3 * (time.perf_counter() - start) / len(queries)
+    print(f"{label:>28} {hits1 / len(queries):>8.3f} {hits10 / len(queries):>9.3f} {ms:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    crops = corpus(args.corpus, rng)
+    truth = rng.choice(args.corpus, args.queries, replace=False)
+    queries = np.stack([degrade(crops[i], rng) for i in truth])
+    names = [(str(i), "synthetic") for i in range(args.corpus)]
+
+    start = time.perf_counter()
+    hashes = multi_hash_batch(crops)
+    search = HashSearch({t: hashes[:, j] for j, t in enumerate(HASH_TYPES)}, names)
+    query_hashes = multi_hash_batch(queries)
+    print(f"hashed {args.corpus} crops in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    index = EmbeddingIndex.build(crops, names, nlist=args.nlist, seed=args.seed)
+    print(f"built IVF-PQ ({len(index.centroids)} lists, {index.codes.shape[1]} bytes/row) "
+          f"in {time.perf_counter() - start:.1f}s")
+    embeddings = index.embed(crops)
+    query_embeddings = index.embed(queries)
+    ranker = CascadeRanker(search)
+
+    def rows(matches):
+        return [int(m.name) for m in matches]
+
+    def two_stage(i):
+        matches = ranker.rank(query_hashes[i], 10)
+        if ambiguous(matches):
+            matches = merge(matches, index.search(queries[i], 10, nprobe=8), 10)
+        return rows(matches)
+
+    print(f"\n{'matcher':>28} {'recall@1':>8} {'recall@10':>9} {'ms/query':>9}")
+    for j, hash_type in enumerate(HASH_TYPES):
+        evaluate(f"{hash_type} top-k", truth,
+                 lambda i, j=j, hash_type=hash_type: rows(search.top_k(query_hashes[i][j], hash_type, 10)), queries)
+    evaluate("hash cascade", truth, lambda i: rows(ranker.rank(query_hashes[i], 10)), queries)
+    evaluate("embedding exact", truth,
+             lambda i: np.argsort(((embeddings - query_embeddings[i]) ** 2).sum(axis=1))[:10], queries)
+    for nprobe in (1, 4, 8, 16, 32):
+        evaluate(f"IVF-PQ nprobe={nprobe}", truth,
+                 lambda i, nprobe=nprobe: index.search_vector(query_embeddings[i], 10, nprobe)[0], queries)
+    evaluate("cascade + IVF-PQ merge", truth, two_stage, queries)
+
+
+if __name__ == "__main__":
+    main()
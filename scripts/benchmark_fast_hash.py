@@ -0,0 +1,80 @@
+"""
+Compare the fused multi-hash kernel against six separate imagehash calls.
+
+Checks that every hash is bit-identical and reports crops/s for imagehash,
+fast_hash.multi_hash and fast_hash.multi_hash_batch.
+
+    python scripts/benchmark_fast_hash.py --crops 500
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import imagehash
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from art_crops import CARD_SIZE, HASH_ART_BOX  # noqa: E402
+from fast_hash import ANTIALIAS, multi_hash, multi_hash_batch, to_hex  # noqa: E402
+
+IMAGEHASH_FUNCTIONS = (imagehash.average_hash, imagehash.phash, imagehash.phash_simple,
+                       imagehash.dhash, imagehash.dhash_vertical, imagehash.whash)
+
+
+def imagehash_hex(crop):
+    return tuple(str(f(crop)) for f in IMAGEHASH_FUNCTIONS)
+
+
+def sample_crops(count, seed):
+    """Art crops of the sample cards plus jittered and random crops, as in rotateCrop.getHash."""
+    rng = np.random.default_rng(seed)
+    cards = [Image.open(p).convert("L").resize(CARD_SIZE, ANTIALIAS) for p in sorted(ROOT.glob("samples/5272*.jpg"))]
+    left, top, right, bottom = HASH_ART_BOX
+    crops = []
+    while len(crops) < count:
+        if cards and len(crops) % 4:
+            card = cards[len(crops) % len(cards)]
+            dx, dy = rng.integers(-6, 7, size=2)
+            crops.append(card.crop((left + dx, top + dy, right + dx, bottom + dy)))
+        else:
+            crops.append(Image.fromarray(rng.integers(0, 256, size=(bottom - top, right - left), dtype=np.uint8)))
+    return crops
+
+
+def rate(label, count, seconds):
+    print(f"{label:>24} {seconds:>8.2f}s {count / seconds:>10.0f} crops/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--crops", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    crops = sample_crops(args.crops, args.seed)
+    stack = np.stack([np.asarray(crop) for crop in crops])
+
+    start = time.perf_counter()
+    expected = [imagehash_hex(crop) for crop in crops]
+    rate("imagehash (6 calls)", len(crops), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    fused = [multi_hash(crop) for crop in crops]
+    rate("multi_hash", len(crops), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    batched = multi_hash_batch(stack)
+    rate("multi_hash_batch", len(crops), time.perf_counter() - start)
+
+    mismatches = sum(tuple(map(to_hex, f)) != e for f, e in zip(fused, expected))
+    mismatches += sum(tuple(map(to_hex, b)) != e for b, e in zip(batched, expected))
+    print(f"mismatching hashes: {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
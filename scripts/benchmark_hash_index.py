@@ -0,0 +1,84 @@
+"""
+Benchmark the multi-index hash radius index against a linear popcount scan.
+
+    python scripts/benchmark_hash_index.py --sizes 30000 300000 3000000 --radius 13
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from hash_radius_index import MultiIndexHash  # noqa: E402
+from hash_search import popcount  # noqa: E402
+
+
+def random_hashes(rng, n):
+    return rng.integers(0, 2**64, size=n, dtype=np.uint64, endpoint=False)
+
+
+def flip_bits(rng, value, bits):
+    for position in rng.choice(64, size=bits, replace=False):
+        value ^= np.uint64(1) << np.uint64(position)
+    return value
+
+
+def linear_within(hashes, query, radius):
+    distances = popcount(hashes ^ query)
+    rows = np.flatnonzero(distances <= radius)
+    return rows[np.lexsort((rows, distances[rows]))]
+
+
+def run(size, radius, queries, seed):
+    rng = np.random.default_rng(seed)
+    hashes = random_hashes(rng, size)
+    # Half the queries are noisy copies of stored hashes, half are random
+    targets = rng.integers(0, size, size=queries)
+    probes = [flip_bits(rng, hashes[t], int(rng.integers(0, radius + 1))) for t in targets[: queries // 2]]
+    probes += list(random_hashes(rng, queries - len(probes)))
+
+    start = time.perf_counter()
+    index = MultiIndexHash(hashes)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [linear_within(hashes, q, radius) for q in probes]
+    linear = (time.perf_counter() - start) / queries
+
+    start = time.perf_counter()
+    found = [index.within(q, radius)[0] for q in probes]
+    indexed = (time.perf_counter() - start) / queries
+
+    mismatches = sum(not np.array_equal(a, b) for a, b in zip(expected, found))
+    candidates = np.mean([index.candidates(q, radius) for q in probes[:20]])
+    return {
+        "size": size,
+        "build_s": build,
+        "linear_ms": linear * 1e3,
+        "index_ms": indexed * 1e3,
+        "speedup": linear / indexed,
+        "candidates": candidates / size,
+        "mismatches": mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[30_000, 300_000, 3_000_000])
+    parser.add_argument("--radius", type=int, default=13)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'hashes':>10} {'build s':>8} {'linear ms':>10} {'index ms':>9} {'speedup':>8} {'cand %':>7} {'diff':>5}")
+    for size in args.sizes:
+        r = run(size, args.radius, args.queries, args.seed)
+        print(f"{r['size']:>10} {r['build_s']:>8.2f} {r['linear_ms']:>10.3f} {r['index_ms']:>9.3f} "
+              f"{r['speedup']:>7.1f}x {100 * r['candidates']:>6.2f}% {r['mismatches']:>5}")
+
+
+if __name__ == "__main__":
+    main()
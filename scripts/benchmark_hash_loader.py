@@ -0,0 +1,86 @@
+"""
+Benchmark the batched hash loader against per-row inserts, using a SQLite file
+as a stand-in for the Postgres tables.
+
+    python scripts/benchmark_hash_loader.py --rows 20000 --batch-sizes 100 1000 5000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from hash_loader import COLUMNS, HashLoader, hex_to_binary  # noqa: E402
+
+SCHEMA = """
+create table binaryhashes(path text, name text, "set" text, ahash text, phash text, psimplehash text,
+                          dhash text, vertdhash text, whash text);
+create table hashes(path text, name text, "set" text, ahash blob, phash blob, psimplehash blob,
+                    dhash blob, vertdhash blob, whash blob);
+"""
+
+
+def connect(path):
+    con = sqlite3.connect(path)
+    con.executescript(SCHEMA)
+    return con
+
+
+def synthetic_rows(n, seed):
+    rng = random.Random(seed)
+    return [(f"images/{i}.jpg", f"Card {i}", f"Set {i % 300}", tuple(f"{rng.getrandbits(64):016x}" for _ in range(6)))
+            for i in range(n)]
+
+
+def load_per_row(con, rows):
+    """One insert per table and one commit per row, like the old addToDb/addHexToDb."""
+    placeholders = ",".join("?" * 9)
+    cur = con.cursor()
+    for path, name, set, hashes in rows:
+        cur.execute(f"INSERT INTO binaryhashes ({COLUMNS}) VALUES ({placeholders})",
+                    (path, name, set, *(hex_to_binary(h) for h in hashes)))
+        con.commit()
+        cur.execute(f"INSERT INTO hashes ({COLUMNS}) VALUES ({placeholders})",
+                    (path, name, set, *(bytes.fromhex(h) for h in hashes)))
+        con.commit()
+
+
+def load_batched(con, rows, batch_size):
+    with HashLoader(con, batch_size) as loader:
+        for row in rows:
+            loader.add(*row)
+
+
+def timed(label, rows, load):
+    with tempfile.TemporaryDirectory() as tmp:
+        con = connect(os.path.join(tmp, "hashes.sqlite"))
+        start = time.perf_counter()
+        load(con)
+        elapsed = time.perf_counter() - start
+        count = con.execute("select count(*) from hashes").fetchone()[0]
+        con.close()
+    assert count == len(rows), f"{label}: loaded {count} of {len(rows)} rows"
+    print(f"{label:>16} {elapsed:>8.2f}s {len(rows) / elapsed:>10.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--skip-per-row", action="store_true", help="skip the slow per-row baseline")
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows, seed=0)
+    if not args.skip_per_row:
+        timed("per-row commit", rows, lambda con: load_per_row(con, rows))
+    for batch_size in args.batch_sizes:
+        timed(f"batch {batch_size}", rows, lambda con: load_batched(con, rows, batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Benchmark every stage of photo identification, CPU only, against a local index.
+
+Runs rotateCrop's pipeline (resize, bilateral filter, Canny, contour
+approximation, perspective warp, hashing) and the cascade scan queryDatabase
+uses on the photos in samples/ plus synthetic perspective-warped renders of
+the samples/5272*.jpg reference cards, whose identity is known.
+
+Reports p50/p95 per stage, images/s, peak traced memory and, for the renders,
+top-1 accuracy. Results are saved as JSON; pass an earlier file to --compare
+to print the change per metric.
+
+    python scripts/benchmark_pipeline.py --index data/hash_index.bin --json run.json
+    python scripts/benchmark_pipeline.py --compare run.json
+
+Without --index (or when the file is missing) a temporary index is written
+holding the reference cards and --filler random rows.
+"""
+import argparse
+import json
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from hash_cascade import CascadeRanker  # noqa: E402
+from hash_search import HASH_TYPES, HashSearch, to_uint64  # noqa: E402
+from rotateCrop import DETECT_STAGES, detectCards, getHash, hashCard, warpCard  # noqa: E402
+
+STAGES = DETECT_STAGES + ("warp", "hash", "scan", "total")
+PHOTOS = ("kessig.JPG", "box.jpg", "frame.jpg")
+
+
+def render(card, rng, size):
+    """Paste card into a noisy size=(w, h) frame under a random perspective; returns the frame."""
+    w, h = size
+    frame = rng.normal(110, 20, size=(h, w, 3)).clip(0, 255).astype(np.uint8)
+    frame = cv2.GaussianBlur(frame, (0, 0), 3)
+    card_h = rng.uniform(0.45, 0.8) * h
+    card_w = card_h * card.shape[1] / card.shape[0]
+    cx, cy = rng.uniform(0.4, 0.6) * w, rng.uniform(0.4, 0.6) * h
+    corners = np.float32([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * (card_w / 2, card_h / 2)
+    angle = np.deg2rad(rng.uniform(-15, 15))
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    corners = corners @ rotation.T + (cx, cy)
+    corners += rng.normal(0, 0.03 * card_w, size=(4, 2))
+    source = np.float32([[0, 0], [card.shape[1], 0], [card.shape[1], card.shape[0]], [0, card.shape[0]]])
+    M = cv2.getPerspectiveTransform(source, corners.astype(np.float32))
+    cv2.warpPerspective(card, M, (w, h), dst=frame, borderMode=cv2.BORDER_TRANSPARENT)
+    return frame
+
+
+def workload(renders, sizes, seed):
+    """(label, expected name or None, BGR image) for every photo and render."""
+    items = []
+    for name in PHOTOS:
+        img = cv2.imread(str(ROOT / "samples" / name))
+        if img is not None:
+            items.append((name, None, img))
+    rng = np.random.default_rng(seed)
+    references = sorted(ROOT.glob("samples/5272*.jpg"))
+    for i in range(renders if references else 0):
+        path = references[i % len(references)]
+        size = sizes[i % len(sizes)]
+        items.append((f"{path.stem} {size[0]}x{size[1]}", path.stem, render(cv2.imread(str(path)), rng, size)))
+    return items
+
+
+def temporary_index(filler, seed):
+    """Index of the reference cards plus filler random rows, in a temporary file."""
+    references = sorted(ROOT.glob("samples/5272*.jpg"))
+    rng = np.random.default_rng(seed)
+    columns = {t: np.concatenate([[to_uint64(h) for h in column],
+                                  rng.integers(0, 2**63, size=filler, dtype=np.int64).view(np.uint64)])
+               for t, column in zip(HASH_TYPES, zip(*(getHash(str(p)) for p in references)))}
+    names = [(p.stem, "samples") for p in references] + [(f"filler {i}", "random") for i in range(filler)]
+    path = Path(tempfile.mkdtemp()) / "benchmark_index.bin"
+    HashSearch(columns, names).write_index_file(path)
+    return path
+
+
+def identify(img, ranker):
+    """One pass of the pipeline; returns (seconds per stage, top match or None)."""
+    start = time.perf_counter()
+    debug = {}
+    detection = detectCards(img, debug)
+    seconds = dict(debug["seconds"])
+    match = None
+    if detection.contours:
+        t = time.perf_counter()
+        warped = warpCard(img, detection.contours[0], detection.scale)
+        seconds["warp"] = time.perf_counter() - t
+        t = time.perf_counter()
+        hashes = hashCard(warped)
+        seconds["hash"] = time.perf_counter() - t
+        t = time.perf_counter()
+        matches = ranker.rank(hashes, 1)
+        seconds["scan"] = time.perf_counter() - t
+        match = matches[0] if matches else None
+    seconds["total"] = time.perf_counter() - start
+    return seconds, match
+
+
+def percentiles(values):
+    values = np.asarray(values) * 1e3
+    return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95)),
+            "mean_ms": float(values.mean()), "count": int(len(values))}
+
+
+def compare(results, baseline):
+    print(f"\n{'metric':>24} {'baseline':>10} {'this run':>10} {'change':>8}")
+    rows = [(f"{stage} p50_ms", baseline["stages"].get(stage, {}).get("p50_ms"), results["stages"][stage]["p50_ms"])
+            for stage in results["stages"]]
+    rows += [(key, baseline.get(key), results[key]) for key in ("images_per_second", "peak_traced_mb", "accuracy")]
+    for label, before, after in rows:
+        if before is None or after is None:
+            continue
+        change = f"{100 * (after - before) / before:+.0f}%" if before else ""
+        print(f"{label:>24} {before:>10.2f} {after:>10.2f} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="hash index file written by buildBinaryDatabase --index-out")
+    parser.add_argument("--filler", type=int, default=100000, help="random rows in the temporary index")
+    parser.add_argument("--renders", type=int, default=30)
+    parser.add_argument("--sizes", nargs="+", default=["1280x720", "1920x1080", "3000x4000"])
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the workload")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="results JSON of an earlier run")
+    args = parser.parse_args()
+
+    index = args.index if args.index and Path(args.index).exists() else temporary_index(args.filler, args.seed)
+    search = HashSearch.from_index_file(index)
+    ranker = CascadeRanker(search)
+    sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes]
+    items = workload(args.renders, sizes, args.seed)
+    print(f"{len(items)} images, {len(search)} indexed cards ({index})")
+
+    identify(items[0][2], ranker)  # warm up
+    stages = {stage: [] for stage in STAGES}
+    correct = labelled = detected = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for label, expected, img in items:
+            seconds, match = identify(img, ranker)
+            for stage, value in seconds.items():
+                stages[stage].append(value)
+            detected += "warp" in seconds
+            if expected is not None:
+                labelled += 1
+                correct += match is not None and match.name == expected
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results = {
+        "config": {"index": str(index), "cards": len(search), "images": len(items), "repeat": args.repeat,
+                   "renders": args.renders, "sizes": args.sizes, "seed": args.seed,
+                   "python": platform.python_version(), "opencv": cv2.__version__, "numpy": np.__version__,
+                   "machine": platform.machine(), "processor": platform.processor()},
+        "stages": {stage: percentiles(values) for stage, values in stages.items() if values},
+        "images_per_second": len(items) * args.repeat / elapsed,
+        "detection_rate": detected / (len(items) * args.repeat),
+        "accuracy": correct / labelled if labelled else None,
+        "peak_traced_mb": peak / 1e6,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+    print(f"{'stage':>10} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8} {'count':>6}")
+    for stage, summary in results["stages"].items():
+        print(f"{stage:>10} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} "
+              f"{summary['mean_ms']:>8.2f} {summary['count']:>6}")
+    print(f"{results['images_per_second']:.1f} images/s, detection rate {results['detection_rate']:.2f}, "
+          f"top-1 accuracy on renders {results['accuracy'] if labelled else float('nan'):.2f}")
+    print(f"peak traced memory {results['peak_traced_mb']:.1f} MB, max RSS {results['max_rss_mb']:.0f} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# coding=utf-8
+"""
+Art crop boxes and the packed art crop store.
+
+Every crop box used on card images lives here. A box is either in pixels of a
+card normalized to CARD_SIZE or, with every value at most 1, a fraction of
+the image size.
+
+The store is one precomputation pass over the image tree. It writes each
+card's normalized grayscale art crop (and optionally the RGB one) into a
+single .npy array that is opened with mmap_mode="r", plus a JSON index of
+image ids. Hash experiments, crop tweaks and evaluations can then run over
+the whole corpus without decoding a JPEG:
+
+    python art_crops.py --out ../data/art_crops --rgb
+"""
+import argparse
+import io
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+CARD_SIZE = (223, 310)
+# Hashed by buildBinaryDatabase and rotateCrop
+HASH_ART_BOX = (25, 37, 195, 150)
+# Wider box of the original Gatherer hash experiments in getHash.py
+GATHERER_ART_BOX = (17, 37, 205, 150)
+# Proportional box the captioners send to the vision models
+CAPTION_ART_BOX = (0.07, 0.11, 0.93, 0.56)
+BOXES = {"hash": HASH_ART_BOX, "gatherer": GATHERER_ART_BOX, "caption": CAPTION_ART_BOX}
+
+IMAGE_DIR = '../data/images/'
+STORE_PATH = '../data/art_crops'
+
+
+def box_pixels(box, size):
+    """Pixel (left, top, right, bottom) of box on an image of size (width, height)."""
+    if all(v <= 1 for v in box) and any(isinstance(v, float) for v in box):
+        width, height = size
+        return (int(width * box[0]), int(height * box[1]), int(width * box[2]), int(height * box[3]))
+    return tuple(box)
+
+
+def crop_art(img, box=CAPTION_ART_BOX):
+    """Crop box out of a PIL image as it is, without normalizing its size."""
+    return img.crop(box_pixels(box, img.size))
+
+
+def normalized_card(img):
+    """PIL card image resized to CARD_SIZE (a no-op on Gatherer images)."""
+    return img.resize(CARD_SIZE, Image.LANCZOS)
+
+
+def crop_size(box):
+    left, top, right, bottom = box_pixels(box, CARD_SIZE)
+    return right - left, bottom - top
+
+
+def _crop_image(task):
+    """Worker: (path, box, rgb) -> (path, gray crop, RGB crop or None), None if unreadable."""
+    path, box, rgb = task
+    try:
+        with open(path, 'rb') as f:
+            img = Image.open(io.BytesIO(f.read()))
+            img.load()
+    except OSError as e:
+        print(f"Skipping {path}: {e}")
+        return None
+    # Same order as the hashers: grayscale, normalize, crop
+    box = box_pixels(box, CARD_SIZE)
+    gray = np.asarray(normalized_card(img.convert('L')).crop(box))
+    color = np.asarray(normalized_card(img.convert('RGB')).crop(box)) if rgb else None
+    return path, gray, color
+
+
+def build_store(paths, out, box=HASH_ART_BOX, rgb=False, workers=1, chunk_size=16, root=None):
+    """
+    Decode every image once and write out.npy (N, height, width) uint8 gray
+    crops, optionally out_rgb.npy (N, height, width, 3), and out.json with the
+    ids (paths relative to root, also recorded) in row order. Unreadable images
+    are left out.
+    """
+    paths = list(paths)
+    width, height = crop_size(box)
+    gray = np.lib.format.open_memmap(out + ".npy.tmp", mode="w+", dtype=np.uint8, shape=(len(paths), height, width))
+    color = np.lib.format.open_memmap(out + "_rgb.npy.tmp", mode="w+", dtype=np.uint8,
+                                      shape=(len(paths), height, width, 3)) if rgb else None
+    tasks = [(path, box, rgb) for path in paths]
+    if workers > 1 and len(tasks) > 1:
+        pool = Pool(workers)
+        results = pool.imap(_crop_image, tasks, chunksize=chunk_size)
+    else:
+        pool = None
+        results = map(_crop_image, tasks)
+    ids = []
+    try:
+        for result in results:
+            if result is None:
+                continue
+            path, g, c = result
+            gray[len(ids)] = g
+            if rgb:
+                color[len(ids)] = c
+            ids.append(os.path.relpath(path, root) if root else path)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for array, suffix in ((gray, ".npy"), (color, "_rgb.npy")):
+        if array is None:
+            continue
+        array.flush()
+        if len(ids) < len(paths):
+            # Drop the rows of unreadable images
+            compact = np.lib.format.open_memmap(out + suffix + ".compact", mode="w+", dtype=np.uint8,
+                                                shape=(len(ids),) + array.shape[1:])
+            compact[:] = array[:len(ids)]
+            compact.flush()
+            del compact
+            os.replace(out + suffix + ".compact", out + suffix + ".tmp")
+        os.replace(out + suffix + ".tmp", out + suffix)
+
+    tmp_path = out + ".json.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"box": list(box), "card_size": list(CARD_SIZE), "rgb": rgb, "root": root, "ids": ids}, f)
+    os.replace(tmp_path, out + ".json")
+    return len(ids)
+
+
+class ArtCropStore:
+    """Read-only memory-mapped view of a store written by build_store."""
+
+    def __init__(self, path):
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.box = tuple(meta["box"])
+        # Image tree the ids are relative to, None for absolute ids or stores from before it was recorded
+        self.root = meta.get("root")
+        self.ids = meta["ids"]
+        self.gray = np.load(path + ".npy", mmap_mode="r")
+        self.rgb = np.load(path + "_rgb.npy", mmap_mode="r") if meta["rgb"] else None
+        self.rows = {id: row for row, id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, id):
+        """Gray crop of one image id."""
+        return self.gray[self.rows[id]]
+
+    def batches(self, batch_size=4096):
+        """(first row, gray crops) blocks over the whole store."""
+        for start in range(0, len(self), batch_size):
+            yield start, self.gray[start:start + batch_size]
+
+    def hash_all(self, batch_size=4096):
+        """multi_hash of every crop, a (rows, 6) uint64 array in HASH_TYPES order."""
+        from fast_hash import multi_hash_batch
+
+        hashes = np.empty((len(self), 6), dtype=np.uint64)
+        for start, crops in self.batches(batch_size):
+            hashes[start:start + len(crops)] = multi_hash_batch(np.asarray(crops))
+        return hashes
+
+
+if __name__ == "__main__":
+    from buildBinaryDatabase import listImages
+
+    parser = argparse.ArgumentParser(description="Pack the art crop of every image in ../data/images/ into one array file")
+    parser.add_argument("--images", default=IMAGE_DIR, help=f"image tree (default: {IMAGE_DIR})")
+    parser.add_argument("--out", default=STORE_PATH, help=f"store path without extension (default: {STORE_PATH})")
+    parser.add_argument("--box", default="hash", choices=sorted(BOXES), help="crop box (default: hash)")
+    parser.add_argument("--rgb", action="store_true", help="also store the RGB crops")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="decoding processes, 1 decodes serially (default: all cores)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = listImages(args.images)
+    count = build_store(paths, args.out, BOXES[args.box], args.rgb, args.workers, root=args.images)
+    elapsed = time.perf_counter() - start
+    print(f"Stored {count} of {len(paths)} crops in {args.out}.npy in {elapsed:.1f}s "
+          f"({count / max(elapsed, 1e-9):.1f} images/s)")
@@ -0,0 +1,268 @@
+# coding=utf-8
+"""
+Second-stage art matcher: PCA pixel descriptors in an IVF-PQ index, NumPy only.
+
+Perceptual hashes break on glare, sleeves and strong perspective. This matcher
+is only consulted when the hash cascade is ambiguous (see ambiguous()), and
+its matches are then ranked together with the cascade's (see merge()).
+
+Every art crop is high-pass filtered, shrunk to DESCRIPTOR_SIZE and
+contrast-normalized, then projected with PCA and L2-normalized. The
+descriptors are clustered into nlist coarse k-means lists (the inverted file)
+and each one is stored as `subspaces` one-byte product-quantizer codes of its
+residual to its list centroid. A query ranks the rows of its nprobe closest lists with per-list
+distance lookup tables.
+
+    python art_embedding.py --store ../data/art_crops --out ../data/art_embedding.npz
+"""
+import argparse
+import itertools
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# (width, height) the art crop is high-passed at, then shrunk to before PCA
+HIGHPASS_SIZE = (64, 48)
+HIGHPASS_SIGMA = 6.0
+DESCRIPTOR_SIZE = (32, 24)
+DIMENSIONS = 64
+SUBSPACES = 16
+CODEBOOK_SIZE = 256
+KMEANS_ITERATIONS = 12
+
+# Hash results weaker than this, or without this margin over the next
+# different card, are merged with the embedding matches. Tuned on the
+# cascade + IVF-PQ recall@1 in scripts/benchmark_embedding.py, where about a
+# quarter of the queries take the fallback
+MIN_CONFIDENCE = 0.5
+MIN_MARGIN = 2.0
+
+EmbeddingMatch = namedtuple("EmbeddingMatch", ["confidence", "distance", "name", "set", "card_id"])
+
+
+def ambiguous(matches, min_confidence=MIN_CONFIDENCE, min_margin=MIN_MARGIN) -> bool:
+    """
+    True when a CascadeRanker result does not settle the card: no match, a
+    weak best match, or another card (reprints of the same name don't count)
+    within min_margin of it.
+    """
+    if not matches or matches[0].confidence < min_confidence:
+        return True
+    best = matches[0]
+    for match in matches[1:]:
+        if match.name != best.name:
+            return match.distance - best.distance < min_margin
+    return False
+
+
+def merge(matches, embedding_matches, k=10):
+    """
+    One ranking of the cascade and embedding matches of a query, by the mean
+    of each card's two confidences; a card only one matcher returned gets the
+    other's lowest confidence in place of the missing one. Each match keeps
+    its own fields but the confidence, cascade matches first on ties.
+    """
+    def key(match):
+        return match.name, match.set, match.card_id
+
+    confidences = [{key(m): m.confidence for m in ranked} for ranked in (matches, embedding_matches)]
+    floors = [min(c.values(), default=0.0) for c in confidences]
+    merged = {}
+    for match in itertools.chain(matches, embedding_matches):
+        if key(match) not in merged:
+            confidence = sum(c.get(key(match), floor) for c, floor in zip(confidences, floors)) / 2
+            merged[key(match)] = match._replace(confidence=confidence)
+    return sorted(merged.values(), key=lambda match: -match.confidence)[:k]
+
+
+def pixel_descriptors(crops) -> np.ndarray:
+    """
+    (N, H, W) uint8 grayscale crops -> (N, w * h) float32. Each crop is shrunk
+    to HIGHPASS_SIZE, loses its low frequencies (glare, lighting gradients),
+    is shrunk again to DESCRIPTOR_SIZE and contrast-normalized.
+    """
+    crops = np.asarray(crops, dtype=np.uint8)
+    if crops.ndim == 2:
+        crops = crops[None]
+    x = np.empty((len(crops), DESCRIPTOR_SIZE[0] * DESCRIPTOR_SIZE[1]), dtype=np.float32)
+    for i, crop in enumerate(crops):
+        small = cv2.resize(crop, HIGHPASS_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+        small -= cv2.GaussianBlur(small, (0, 0), HIGHPASS_SIGMA)
+        x[i] = cv2.resize(small, DESCRIPTOR_SIZE, interpolation=cv2.INTER_AREA).ravel()
+    x -= x.mean(axis=1, keepdims=True)
+    x /= np.maximum(x.std(axis=1, keepdims=True), 1e-3)
+    return x
+
+
+def squared_distances(x, centroids):
+    """(N, K) squared Euclidean distances between rows of x and centroids."""
+    d = (x * x).sum(axis=1)[:, None] - 2 * x @ centroids.T + (centroids * centroids).sum(axis=1)[None, :]
+    return np.maximum(d, 0, out=d)
+
+
+def kmeans(x, k, iterations=KMEANS_ITERATIONS, rng=None):
+    """Lloyd's k-means from k random rows; empty clusters are reseeded from random rows."""
+    rng = rng or np.random.default_rng(0)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = squared_distances(x, centroids).argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()))]
+    return centroids
+
+
+class EmbeddingIndex:
+    """IVF-PQ index of art descriptors; rows map to (name, set) and card ids like a HashSearch."""
+
+    def __init__(self, mean, components, centroids, codebooks, codes, rows, offsets, names, card_ids=None):
+        self.mean = mean
+        self.components = components
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self.codes = codes
+        self.rows = rows
+        self.offsets = offsets
+        self.names = names
+        self.card_ids = card_ids
+
+    @classmethod
+    def build(cls, crops, names, card_ids=None, dimensions=DIMENSIONS, nlist=None, subspaces=SUBSPACES,
+              sample=50000, batch_size=4096, seed=0):
+        """
+        Index (N, H, W) grayscale art crops (an ArtCropStore.gray memmap works).
+        PCA, the coarse lists and the codebooks are trained on up to sample rows.
+        """
+        rng = np.random.default_rng(seed)
+        count = len(crops)
+        nlist = nlist or max(1, min(4096, int(4 * np.sqrt(count))))
+        training = np.sort(rng.choice(count, min(sample, count), replace=False))
+        x = pixel_descriptors(np.asarray(crops[training]))
+        mean = x.mean(axis=0)
+        _, _, vt = np.linalg.svd(x - mean, full_matrices=False)
+        # Fewer training rows than dimensions leave the last components zero
+        components = np.zeros((dimensions, x.shape[1]), dtype=np.float32)
+        components[:len(vt[:dimensions])] = vt[:dimensions]
+
+        index = cls(mean, components, None, None, None, None, None, names, card_ids)
+        x = index.project(x)
+        index.centroids = kmeans(x, nlist, rng=rng)
+        labels = squared_distances(x, index.centroids).argmin(axis=1)
+        residuals = (x - index.centroids[labels]).reshape(len(x), subspaces, -1)
+        index.codebooks = np.stack([kmeans(residuals[:, m], CODEBOOK_SIZE, rng=rng) for m in range(subspaces)])
+
+        labels = np.empty(count, dtype=np.int32)
+        codes = np.empty((count, subspaces), dtype=np.uint8)
+        for start in range(0, count, batch_size):
+            x = index.embed(crops[start:start + batch_size])
+            labels[start:start + len(x)], codes[start:start + len(x)] = index.encode(x)
+        index.rows = np.argsort(labels, kind="stable").astype(np.int32)
+        index.offsets = np.zeros(len(index.centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=len(index.centroids)), out=index.offsets[1:])
+        index.codes = codes[index.rows]
+        return index
+
+    def save(self, path):
+        names = np.array([f"{name}\t{set}" for name, set in self.names])
+        extra = {} if self.card_ids is None else {"card_ids": self.card_ids}
+        np.savez(path, mean=self.mean, components=self.components, centroids=self.centroids,
+                 codebooks=self.codebooks, codes=self.codes, rows=self.rows, offsets=self.offsets,
+                 names=names, **extra)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            names = [tuple(entry.split("\t", 1)) for entry in data["names"].tolist()]
+            card_ids = data["card_ids"] if "card_ids" in data else None
+            return cls(data["mean"], data["components"], data["centroids"], data["codebooks"], data["codes"],
+                       data["rows"], data["offsets"], names, card_ids)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def project(self, descriptors):
+        x = (descriptors - self.mean) @ self.components.T
+        return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-6)
+
+    def embed(self, crops):
+        """(N, H, W) grayscale art crops (or one crop) -> (N, dimensions) unit vectors."""
+        return self.project(pixel_descriptors(crops))
+
+    def encode(self, x):
+        """Coarse list and PQ codes of every embedding."""
+        labels = squared_distances(x, self.centroids).argmin(axis=1)
+        residuals = (x - self.centroids[labels]).reshape(len(x), len(self.codebooks), -1)
+        codes = np.stack([squared_distances(residuals[:, m], self.codebooks[m]).argmin(axis=1)
+                          for m in range(len(self.codebooks))], axis=1)
+        return labels, codes.astype(np.uint8)
+
+    def search_vector(self, q, k=10, nprobe=8):
+        """(rows, approximate squared distances) of the k nearest rows to one embedding."""
+        nprobe = min(nprobe, len(self.centroids))
+        coarse = squared_distances(q[None], self.centroids)[0]
+        lists = np.argpartition(coarse, nprobe - 1)[:nprobe]
+        starts, ends = self.offsets[lists], self.offsets[lists + 1]
+        sizes = ends - starts
+        if sizes.sum() == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        positions = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        which = np.repeat(np.arange(nprobe), sizes)
+        # tables[p, m, c]: distance of the query residual for list p to codeword c of subspace m
+        subspaces = len(self.codebooks)
+        residuals = (q[None] - self.centroids[lists]).reshape(nprobe, subspaces, 1, -1)
+        tables = ((residuals - self.codebooks[None]) ** 2).sum(axis=-1)
+        codes = self.codes[positions]
+        distances = tables[which[:, None], np.arange(subspaces)[None], codes].sum(axis=1)
+        k = min(k, len(distances))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best], kind="stable")]
+        return self.rows[positions[best]], distances[best]
+
+    def search(self, crop, k=10, nprobe=8):
+        """EmbeddingMatch list for one grayscale art crop, closest first."""
+        rows, distances = self.search_vector(self.embed(crop)[0], k, nprobe)
+        matches = []
+        for row, distance in zip(rows, distances):
+            name, set = self.names[row]
+            # Squared distance between unit vectors is 2 - 2 cos
+            card_id = None if self.card_ids is None or self.card_ids[row] < 0 else int(self.card_ids[row])
+            matches.append(EmbeddingMatch(max(0.0, 1.0 - float(distance) / 2), float(distance), name, set, card_id))
+        return matches
+
+
+if __name__ == "__main__":
+    from art_crops import IMAGE_DIR, STORE_PATH, ArtCropStore
+    from buildBinaryDatabase import getCardInfo, sidecarCardInfo
+    from card_metadata import multiverse_id
+
+    parser = argparse.ArgumentParser(description="Build the art embedding index from the art crop store")
+    parser.add_argument("--store", default=STORE_PATH, help=f"art crop store (default: {STORE_PATH})")
+    parser.add_argument("--images", help=f"image tree the store ids are relative to "
+                                         f"(default: the one it was built from, else {IMAGE_DIR})")
+    parser.add_argument("--out", default="../data/art_embedding.npz")
+    parser.add_argument("--nlist", type=int, help="coarse lists (default: 4 * sqrt(rows))")
+    args = parser.parse_args()
+
+    store = ArtCropStore(args.store)
+    root = args.images or store.root or IMAGE_DIR
+    rows, names, card_ids = [], [], []
+    for row, id in enumerate(store.ids):
+        path = os.path.join(root, id)
+        try:
+            names.append(sidecarCardInfo(path) or getCardInfo(path))
+        except IndexError:
+            print(f"Skipping {path}: no sidecar and not a <name>   <set> file name")
+            continue
+        rows.append(row)
+        card_id = multiverse_id(path)
+        card_ids.append(-1 if card_id is None else card_id)
+    crops = store.gray if len(rows) == len(store) else store.gray[rows]
+    index = EmbeddingIndex.build(crops, names, np.array(card_ids, dtype=np.int64), nlist=args.nlist)
+    index.save(args.out)
+    print(f"Indexed {len(index)} crops in {len(index.centroids)} lists to {args.out}")
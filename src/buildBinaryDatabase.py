@@ -1,71 +1,251 @@
 # coding=utf-8
+import argparse
+import io
+import itertools
+import json
 import os
-import sys
-import imagehash
-import numpy
+import time
+from multiprocessing import Pool
+import numpy as np
 from PIL import Image
 import psycopg2
-import binascii
+from tqdm import tqdm
+from art_crops import HASH_ART_BOX, normalized_card
+from card_metadata import METADATA_PATH, CardMetadata, multiverse_id
+from fast_hash import multi_hash_hex
+from hash_loader import HashLoader, ensure_path_column
+from hash_manifest import HashManifest, content_digest
+from hash_search import HASH_TYPES, HashSearch
 
+IMAGE_DIR = '../data/images/'
+MANIFEST_PATH = '../data/hash_manifest.json'
+INDEX_PATH = '../data/hash_index.bin'
+# Clockwise degrees a card can lie turned by in a photo
+ROTATIONS = (0, 90, 180, 270)
 
-def hex_to_binary(hashString):
-    return format(int(hashString,16),'0>64b')
 
 def getHash(img):
-	normal = Image.open(img).convert('L')
-	crop=normal.crop((25,37,195,150))
-	ahash = str(imagehash.average_hash(crop))
-        phash = str(imagehash.phash(crop))
-	psimplehash = str(imagehash.phash_simple(crop))
-	dhash = str(imagehash.dhash(crop))
-	vertdhash = str(imagehash.dhash_vertical(crop))
-	whash = str(imagehash.whash(crop))
-	return ahash,phash,psimplehash,dhash,vertdhash,whash
-
-def addToDb(name,set,hashes):
-        print hashes,"---",name,"---",set
-	command = "INSERT INTO binaryhashes (name,set,ahash,phash,psimplehash,dhash,vertdhash,whash) VALUES('"
-        command +=name+"','"+set+"'"
-        for i in range (0,6):
-            command+=",'"+hex_to_binary(hashes[i])+"'"
-        command+=");"
-	cur.execute(command)
-	con.commit()
-
-def addHexToDb(name,set,hashes):
-        print hashes,"---",name,"---",set
-        command = "INSERT INTO hashes (name,set,ahash,phash,psimplehash,dhash,vertdhash,whash) VALUES('"
-        command +=name+"','"+set+"'"
-        for i in range (0,6):
-            command+=",decode('"+hashes[i]+"','hex')"
-        command+=");"
-        cur.execute(command)
-        con.commit()
+    normal = Image.open(img).convert('L')
+    crop=normal.crop(HASH_ART_BOX)
+    # ahash,phash,psimplehash,dhash,vertdhash,whash from a single grayscale crop
+    return multi_hash_hex(crop)
+
+def getRotatedHashes(img):
+    """
+    getHash of the card turned clockwise by each of ROTATIONS, cropped the way
+    rotateCrop crops a photo warp of it: a card turned a quarter warps to a
+    landscape image that is squeezed to the card size before the art crop.
+    """
+    normal = Image.open(img).convert('L')
+    return [multi_hash_hex(normalized_card(normal.rotate(-degrees, expand=True)).crop(HASH_ART_BOX))
+            for degrees in ROTATIONS]
 
 def getCardInfo(card):
-	card =card[11:]
-	card = card.replace('%20',' ')
-	card = card.replace("'","''")
-	n=0
-	cardName =''
-	setName =''
-        cardDetails = card.split('   ')
-	cardName=cardDetails[0]
-        setName=cardDetails[1][:-4]
-	return (cardName,setName)
-
-con = psycopg2.connect(database='cardimages', user='Devon')
-cur = con.cursor()
-
-cur.execute("delete from hashes")
-cur.execute("delete from binaryhashes")
-con.commit()
-
-for root, dirs, files in os.walk('../data/images/', topdown=False):
-    for name in files:
-	hold =os.path.join(root, name)
-        if(name!=".gitignore"):
-            hashToAdd = getHash(hold)
-            cardInfo = getCardInfo(hold)
-	    addToDb(cardInfo[0],cardInfo[1],hashToAdd)
-	    addHexToDb(cardInfo[0],cardInfo[1],hashToAdd)
+    card =card[11:]
+    card = card.replace('%20',' ')
+    cardDetails = card.split('   ')
+    cardName=cardDetails[0]
+    setName=cardDetails[1][:-4]
+    return (cardName,setName)
+
+def sidecarCardInfo(card):
+    """(name, set) from the Scryfall .json next to a <set>/<multiverse id>.jpg image, or None."""
+    try:
+        with open(os.path.splitext(card)[0] + '.json', 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return (data['name'], data['set_name']) if 'name' in data and 'set_name' in data else None
+
+def listImages(root_dir):
+    """Every image path under root_dir, in a stable order."""
+    paths = []
+    for root, dirs, files in os.walk(root_dir, topdown=False):
+        for name in files:
+            if(name!=".gitignore" and not name.endswith(('.json', '.txt'))):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+def hashImage(task):
+    """
+    Worker for one (path, known_digest) task. Returns (path, size, mtime_ns,
+    digest, (name, set, hashes)), with None instead of the card when the content
+    digest equals known_digest, or None if the image can't be read.
+    """
+    path, known_digest = task
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        digest = content_digest(data)
+        if digest == known_digest:
+            return path, st.st_size, st.st_mtime_ns, digest, None
+        cardInfo = sidecarCardInfo(path) or getCardInfo(path)
+        card = (cardInfo[0], cardInfo[1], getHash(io.BytesIO(data)))
+        return path, st.st_size, st.st_mtime_ns, digest, card
+    except (OSError, IndexError) as e:
+        print(f"Skipping {path}: {e}")
+        return None
+
+def hashRotations(path):
+    """Worker: (path, name, set, hashes per rotation) of one image, or None if it can't be read."""
+    try:
+        cardInfo = sidecarCardInfo(path) or getCardInfo(path)
+        return path, cardInfo[0], cardInfo[1], getRotatedHashes(path)
+    except (OSError, IndexError) as e:
+        print(f"Skipping {path}: {e}")
+        return None
+
+def hashImages(tasks, workers, chunk_size, worker=hashImage):
+    """
+    Yield worker (hashImage by default) results for every task. With more than
+    one worker the images are hashed in a process pool and yielded as they
+    complete, so the caller stays the single database writer.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        yield from map(worker, tasks)
+        return
+    with Pool(workers) as pool:
+        yield from pool.imap_unordered(worker, tasks, chunksize=chunk_size)
+
+def clearDb(con):
+    cur = con.cursor()
+    cur.execute("delete from hashes")
+    cur.execute("delete from binaryhashes")
+    con.commit()
+
+def build(con, workers, chunk_size, batch_size, manifest=None):
+    """
+    Hash the image tree into the database. Without a manifest (or with an empty
+    one) the tables are cleared and every image is hashed; otherwise only new
+    or changed images are hashed and upserted, and rows of removed images are
+    deleted. Rows are keyed by image path, so other printings of the same
+    name and set are left alone.
+    """
+    start = time.perf_counter()
+    paths = listImages(IMAGE_DIR)
+    # Tables from before the path column can't be updated row by row
+    keyed = ensure_path_column(con)
+    incremental = manifest is not None and len(manifest) > 0 and keyed
+    if incremental:
+        tasks, removed = manifest.scan(paths)
+    else:
+        clearDb(con)
+        if manifest is not None:
+            manifest.entries.clear()
+        tasks, removed = [(path, None) for path in paths], []
+    added = 0
+    with HashLoader(con, batch_size) as loader:
+        for path in removed:
+            entry = manifest.forget(path)
+            if entry.get("name") is not None:
+                loader.remove(path)
+        for result in tqdm(hashImages(tasks, workers, chunk_size), total=len(tasks), unit="img"):
+            if result is None:
+                continue
+            path, size, mtime_ns, digest, card = result
+            if card is not None:
+                # Only images the manifest already had can have a row to replace
+                known = incremental and manifest.entries.get(path, {}).get("name") is not None
+                loader.add(path, *card, replace=known)
+                added += 1
+            if manifest is not None:
+                name, set = card[:2] if card is not None else (None, None)
+                manifest.record(path, size, mtime_ns, digest, name, set)
+    if manifest is not None:
+        manifest.save()
+    elapsed = time.perf_counter() - start
+    print(f"Hashed {added} of {len(paths)} images ({len(removed)} removed) in {elapsed:.1f}s "
+          f"({added / max(elapsed, 1e-9):.1f} images/s, {workers} workers)")
+
+def writeIndexFile(con, path, metadata_path=None):
+    """
+    Export the whole binaryhashes table to the memory-mapped query index. Rows
+    carry the multiverse id of their <multiverse id>.jpg image, else the one
+    the card_metadata table has for their name and set, else -1.
+    """
+    ensure_path_column(con)
+    cur = con.cursor()
+    cur.execute(f'select path,name,"set",{",".join(HASH_TYPES)} from binaryhashes')
+    rows = cur.fetchall()
+    con.commit()
+    ids = CardMetadata(metadata_path).ids_by_name() if metadata_path and os.path.exists(metadata_path) else {}
+    card_ids = []
+    for image, name, set, *_ in rows:
+        card_id = multiverse_id(image) if image else None
+        card_ids.append(card_id if card_id is not None else ids.get((name, set), -1))
+    engine = HashSearch.from_rows(row[1:] for row in rows)
+    engine.card_ids = np.array(card_ids, dtype=np.int64)
+    print(f"Tagged {int((engine.card_ids >= 0).sum())} rows with multiverse ids")
+    engine.write_index_file(path)
+    print(f"Wrote {len(engine)} rows to {path}")
+
+def writeRotationIndexFile(path, workers, chunk_size, metadata_path=None, manifest=None):
+    """
+    Hash every image at each of ROTATIONS straight into a query index with one
+    row per card and orientation, so one scan finds a card however it lies.
+    Rows carry the multiverse id of <multiverse id>.jpg images, else the one
+    the card_metadata table has for their name and set, else -1. With a
+    manifest (kept current by build) the hashes of unchanged images are reused
+    from it and only new or changed images are decoded.
+    """
+    start = time.perf_counter()
+    paths = listImages(IMAGE_DIR)
+    ids = CardMetadata(metadata_path).ids_by_name() if metadata_path and os.path.exists(metadata_path) else {}
+    cached = {}
+    if manifest is not None:
+        for image in paths:
+            known = manifest.rotations(image)
+            if known is not None:
+                cached[image] = (image, *known)
+    tasks = [image for image in paths if image not in cached]
+    results = itertools.chain(cached.values(), hashImages(tasks, workers, chunk_size, hashRotations))
+    rows, card_ids, orientations = [], [], []
+    for result in tqdm(results, total=len(paths), unit="img"):
+        if result is None:
+            continue
+        image, name, set, hashes = result
+        if manifest is not None and image not in cached:
+            manifest.record_rotations(image, name, set, hashes)
+        card_id = multiverse_id(image)
+        for degrees, rotated in zip(ROTATIONS, hashes):
+            rows.append((name, set, *rotated))
+            card_ids.append(card_id if card_id is not None else ids.get((name, set), -1))
+            orientations.append(degrees)
+    if manifest is not None:
+        manifest.save()
+    engine = HashSearch.from_rows(rows)
+    engine.card_ids = np.array(card_ids, dtype=np.int64)
+    engine.orientations = np.array(orientations, dtype=np.uint16)
+    engine.write_index_file(path)
+    print(f"Wrote {len(engine)} rows ({len(ROTATIONS)} orientations, {len(tasks)} images hashed) to {path} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the perceptual hash database from ../data/images/")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="hashing processes, 1 hashes serially (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=16,
+                        help="images handed to a worker at a time")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="rows written per insert batch and transaction")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only hash new or changed images, tracked in --manifest")
+    parser.add_argument("--manifest", default=MANIFEST_PATH,
+                        help=f"image manifest used by --incremental (default: {MANIFEST_PATH})")
+    parser.add_argument("--index-out", default=INDEX_PATH,
+                        help=f"memory-mapped query index written after the build (default: {INDEX_PATH})")
+    parser.add_argument("--metadata", default=METADATA_PATH,
+                        help=f"card_metadata table whose multiverse ids go into the index (default: {METADATA_PATH})")
+    parser.add_argument("--rotations", action="store_true",
+                        help="write the index with every card at 0, 90, 180 and 270 degrees, hashed from the images "
+                             "(with --incremental, only new or changed ones)")
+    args = parser.parse_args()
+
+    con = psycopg2.connect(database='cardimages', user='Devon')
+    manifest = HashManifest(args.manifest) if args.incremental else None
+    build(con, args.workers, args.chunk_size, args.batch_size, manifest)
+    if args.rotations:
+        writeRotationIndexFile(args.index_out, args.workers, args.chunk_size, args.metadata, manifest)
+    else:
+        writeIndexFile(con, args.index_out, args.metadata)
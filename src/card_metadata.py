@@ -0,0 +1,158 @@
+# coding=utf-8
+"""
+Card metadata table keyed by multiverse id.
+
+write_captions.save_metadata stores the Scryfall JSON of every card next to
+its image (<set>/<multiverse id>.json). build_metadata reads all the sidecars
+once into a small SQLite table, so identification results can be enriched
+(rarity, artist, oracle text, Scryfall id) with a primary key lookup instead
+of a file read per match:
+
+    python card_metadata.py --images ../data/images/ --out ../data/card_metadata.sqlite
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+IMAGE_DIR = '../data/images/'
+METADATA_PATH = '../data/card_metadata.sqlite'
+
+# Scryfall card fields kept per card, besides the multiverse id
+FIELDS = ("id", "name", "set", "set_name", "collector_number", "rarity", "artist", "type_line",
+          "mana_cost", "oracle_text", "flavor_text", "power", "toughness", "colors")
+# Column names, where they differ from the Scryfall field
+COLUMN_NAMES = {"id": "scryfall_id", "set": "set_code"}
+COLUMNS = ("multiverse_id",) + tuple(COLUMN_NAMES.get(f, f) for f in FIELDS) + ("image_path",)
+
+SCHEMA = f"""
+create table cards (multiverse_id integer primary key, {", ".join(f"{c} text" for c in COLUMNS[1:])});
+create index cards_name_set on cards (name, set_name);
+"""
+
+
+def multiverse_id(path):
+    """Multiverse id of an image or sidecar named <multiverse id>.<ext>, else None."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return int(stem) if stem.isdigit() else None
+
+
+def card_row(data: dict, path: str):
+    """cards row of one sidecar, or None when it has no multiverse id."""
+    key = multiverse_id(path)
+    if key is None and data.get("multiverse_ids"):
+        key = data["multiverse_ids"][0]
+    if key is None:
+        return None
+    values = [data.get(f) for f in FIELDS]
+    values = [json.dumps(v) if isinstance(v, (list, dict)) else v for v in values]
+    return (key, *values, os.path.splitext(path)[0] + ".jpg")
+
+
+def sidecars(root):
+    for dirpath, _, files in os.walk(root):
+        for name in sorted(files):
+            if name.endswith(".json"):
+                yield os.path.join(dirpath, name)
+
+
+def build_metadata(root, out, batch_size=1000) -> int:
+    """Read every .json sidecar under root into a fresh metadata table at out."""
+    tmp_path = out + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = sqlite3.connect(tmp_path)
+    con.executescript(SCHEMA)
+    insert = f"insert or replace into cards ({','.join(COLUMNS)}) values ({','.join('?' * len(COLUMNS))})"
+    rows, count = [], 0
+    for path in sidecars(root):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                row = card_row(json.load(f), path)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Skipping {path}: {e}")
+            continue
+        if row is not None:
+            rows.append(row)
+        if len(rows) >= batch_size:
+            con.executemany(insert, rows)
+            count += len(rows)
+            rows = []
+    con.executemany(insert, rows)
+    count += len(rows)
+    con.commit()
+    con.close()
+    os.replace(tmp_path, out)
+    return count
+
+
+class CardMetadata:
+    """Read-only lookups in a table written by build_metadata; safe to share between threads."""
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.con = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.con.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return self.con.execute("select count(*) from cards").fetchone()[0]
+
+    def _one(self, query, params):
+        with self.lock:
+            row = self.con.execute(query, params).fetchone()
+        if row is None:
+            return None
+        card = dict(row)
+        if card.get("colors"):
+            card["colors"] = json.loads(card["colors"])
+        return card
+
+    def get(self, multiverse_id):
+        """Metadata dict of one multiverse id, or None."""
+        return self._one("select * from cards where multiverse_id = ?", (int(multiverse_id),))
+
+    def find(self, name, set_name):
+        """Metadata of the lowest multiverse id printed as name in set_name, or None."""
+        return self._one("select * from cards where name = ? and set_name = ? order by multiverse_id limit 1",
+                         (name, set_name))
+
+    def ids_by_name(self) -> dict:
+        """(name, set name) -> lowest multiverse id, for tagging hash rows that only know their name."""
+        with self.lock:
+            rows = self.con.execute("select name, set_name, min(multiverse_id) from cards group by name, set_name")
+            return {(name, set_name): key for name, set_name, key in rows}
+
+    def lookup(self, card_id, name, set_name):
+        """
+        Metadata of a match: by its card id when the builder tagged one, else by
+        name and set. An id whose card has another name or set (row numbers in
+        index files from before ids were tagged) is not trusted.
+        """
+        card = self.get(card_id) if card_id is not None and card_id >= 0 else None
+        if card is not None and (card["name"], card["set_name"]) == (name, set_name):
+            return card
+        return self.find(name, set_name)
+
+    def enrich(self, match) -> dict:
+        """A match namedtuple (CascadeMatch, Match, EmbeddingMatch) as a dict with its "metadata"."""
+        result = match._asdict()
+        result["metadata"] = self.lookup(result.get("card_id"), result["name"], result["set"])
+        return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build the card metadata table from the .json sidecars")
+    parser.add_argument("--images", default=IMAGE_DIR, help=f"image tree with the sidecars (default: {IMAGE_DIR})")
+    parser.add_argument("--out", default=METADATA_PATH, help=f"SQLite file (default: {METADATA_PATH})")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = build_metadata(args.images, args.out)
+    logging.info(f"Wrote metadata of {count} cards to {args.out} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,133 @@
+# coding=utf-8
+"""
+Fused perceptual hashing: all six imagehash hashes from one grayscale image.
+
+imagehash.average_hash, phash, phash_simple, dhash, dhash_vertical and whash
+each convert and resize the image again. Here the grayscale conversion happens
+once, phash and phash_simple share one 32x32 resize and one row DCT, and the
+results come back as uint64 in HASH_TYPES order. The output is bit-identical to
+imagehash; see scripts/benchmark_fast_hash.py.
+"""
+import numpy as np
+import pywt
+from PIL import Image
+
+try:
+    ANTIALIAS = Image.Resampling.LANCZOS
+except AttributeError:
+    ANTIALIAS = Image.ANTIALIAS
+
+HASH_SIZE = 8
+DCT_SIZE = 4 * HASH_SIZE
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Unnormalized DCT-II matrix, matching scipy.fftpack.dct(x) == x @ C.T."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    return 2 * np.cos(np.pi * k * (2 * i + 1) / (2 * n))
+
+
+# Only the lowest HASH_SIZE + 1 frequencies are used by phash and phash_simple
+_DCT = _dct_matrix(DCT_SIZE)[:HASH_SIZE + 1]
+
+
+def pack_bits(bits: np.ndarray) -> np.ndarray:
+    """Pack boolean (..., 8, 8) hash arrays into uint64, first bit most significant."""
+    bits = bits.reshape(bits.shape[:-2] + (-1,))
+    return np.packbits(bits, axis=-1).view(">u8")[..., 0].astype(np.uint64)
+
+
+def to_hex(value) -> str:
+    """uint64 hash as the hex string str(ImageHash) gives."""
+    return f"{int(value):016x}"
+
+
+def _resized(gray: Image.Image, size) -> np.ndarray:
+    return np.asarray(gray.resize(size, ANTIALIAS))
+
+
+def _whash_scale(size) -> int:
+    return max(2**int(np.log2(min(size))), HASH_SIZE)
+
+
+def _whash_bits(pixels: np.ndarray) -> np.ndarray:
+    """
+    imagehash.whash with its defaults (haar, remove_max_haar_ll) for a
+    (..., S, S) stack of images already resized to the wavelet scale S.
+    """
+    ll_max_level = int(np.log2(pixels.shape[-1]))
+    dwt_level = ll_max_level - int(np.log2(HASH_SIZE))
+    pixels = pixels / 255.
+    coeffs = list(pywt.wavedec2(pixels, 'haar', level=ll_max_level))
+    coeffs[0] *= 0
+    pixels = pywt.waverec2(coeffs, 'haar')
+    dwt_low = pywt.wavedec2(pixels, 'haar', level=dwt_level)[0]
+    flat = dwt_low.reshape(dwt_low.shape[:-2] + (-1,))
+    return dwt_low > np.median(flat, axis=-1)[..., None, None]
+
+
+def _dct_bits(pixels: np.ndarray):
+    """phash and phash_simple bits for a (..., 32, 32) stack of resized images."""
+    pixels = pixels.astype(np.float64)
+    # Row DCT shared by both, one matrix multiply for the whole stack: (..., 32, 9)
+    rows = (pixels.reshape(-1, DCT_SIZE) @ _DCT.T).reshape(pixels.shape[:-1] + (HASH_SIZE + 1,))
+    simple = rows[..., :HASH_SIZE, 1:HASH_SIZE + 1]
+    simple_bits = simple > simple.mean(axis=(-2, -1), keepdims=True)
+    low = _DCT[:HASH_SIZE] @ rows[..., :HASH_SIZE]
+    flat = low.reshape(low.shape[:-2] + (-1,))
+    phash_bits = low > np.median(flat, axis=-1)[..., None, None]
+    return phash_bits, simple_bits
+
+
+def _resize_all(gray: Image.Image):
+    """Every resize the six hashes need, each done once."""
+    scale = _whash_scale(gray.size)
+    small = _resized(gray, (HASH_SIZE, HASH_SIZE))
+    dct_pixels = _resized(gray, (DCT_SIZE, DCT_SIZE))
+    horizontal = _resized(gray, (HASH_SIZE + 1, HASH_SIZE))
+    vertical = _resized(gray, (HASH_SIZE, HASH_SIZE + 1))
+    wavelet = _resized(gray, (scale, scale))
+    return small, dct_pixels, horizontal, vertical, wavelet
+
+
+def _stack_bits(small, phash_bits, simple_bits, horizontal, vertical, whash_bits):
+    ahash_bits = small > small.mean(axis=(-2, -1), keepdims=True)
+    dhash_bits = horizontal[..., :, 1:] > horizontal[..., :, :-1]
+    vertdhash_bits = vertical[..., 1:, :] > vertical[..., :-1, :]
+    bits = np.stack([ahash_bits, phash_bits, simple_bits, dhash_bits, vertdhash_bits, whash_bits], axis=-3)
+    return pack_bits(bits)
+
+
+def multi_hash(image: Image.Image) -> np.ndarray:
+    """ahash, phash, psimplehash, dhash, vertdhash and whash of image as 6 uint64."""
+    small, dct_pixels, horizontal, vertical, wavelet = _resize_all(image.convert('L'))
+    phash_bits, simple_bits = _dct_bits(dct_pixels)
+    return _stack_bits(small, phash_bits, simple_bits, horizontal, vertical, _whash_bits(wavelet))
+
+
+def multi_hash_hex(image: Image.Image):
+    """multi_hash as a tuple of hex strings, like str(imagehash.xxx(image))."""
+    return tuple(to_hex(value) for value in multi_hash(image))
+
+
+def multi_hash_batch(crops: np.ndarray) -> np.ndarray:
+    """
+    Hash an (N, H, W) uint8 stack of grayscale crops, returning (N, 6) uint64.
+
+    Resizing stays per image (through PIL, to stay bit-identical), but the DCTs
+    of all N images are computed with one matrix multiply and the wavelet
+    transforms with one pywt call over the whole stack.
+    """
+    crops = np.asarray(crops, dtype=np.uint8)
+    if crops.ndim != 3:
+        raise ValueError(f"Expected an (N, H, W) stack of crops, got shape {crops.shape}")
+    if len(crops) == 0:
+        return np.zeros((0, 6), dtype=np.uint64)
+    resized = [[] for _ in range(5)]
+    for crop in crops:
+        for stack, pixels in zip(resized, _resize_all(Image.fromarray(crop))):
+            stack.append(pixels)
+    small, dct_pixels, horizontal, vertical, wavelet = (np.stack(stack) for stack in resized)
+    phash_bits, simple_bits = _dct_bits(dct_pixels)
+    return _stack_bits(small, phash_bits, simple_bits, horizontal, vertical, _whash_bits(wavelet))
@@ -3,25 +3,26 @@ import os
 import sys
 import imagehash
 import numpy
-from src import queryDatabase
+import queryDatabase
+from art_crops import GATHERER_ART_BOX
 from PIL import Image
 import psycopg2
 
 def gatherer_perception_hash(img):
         normal = Image.open(img).convert('L')
-        crop=normal.crop((17,37,205,150))
+        crop=normal.crop(GATHERER_ART_BOX)
         hash = str(imagehash.phash(crop))
         return int(format(int(hash,16),'064b'))
 
 def gatherer_simple_hash(img):
         normal = Image.open(img).convert('L')
-        crop=normal.crop((17,37,205,150))
+        crop=normal.crop(GATHERER_ART_BOX)
         hash = str(imagehash.phash_simple(crop))
         return int(format(int(hash,16),'064b'))
 
 def gatherer_dhash(img):
         normal = Image.open(img).convert('L')
-        crop=normal.crop((17,37,205,150))
+        crop=normal.crop(GATHERER_ART_BOX)
         hash = str(imagehash.dhash(crop))
         return int(format(int(hash,16),'064b'))
 
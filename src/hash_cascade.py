@@ -0,0 +1,146 @@
+# coding=utf-8
+"""
+Multi-hash cascade ranking with early rejection.
+
+Instead of one full scan per hash type, the first stage scans a single hash
+column and every later stage only compares the rows that survived the previous
+ones. A stage prunes by rank, not by an absolute threshold: it keeps the `keep`
+rows with the best weighted distance over the stages so far, so a true match
+that one hash places far off is still carried by the others. The weighted
+distance of the final survivors gives their order and confidence.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from hash_search import HASH_TYPES, popcount, to_uint64
+
+# keep: rows passed on to the next stage (never fewer than the k asked for);
+# max_distance: optional absolute cutoff on this stage's own distance, which
+# uses the column's radius index in the first stage when one is built
+Stage = namedtuple("Stage", ["hash_type", "keep", "weight", "max_distance"], defaults=(1.0, None))
+
+# phash is the most selective on card art, so it filters first. The weights
+# were tuned on the cascade's recall@1 in scripts/benchmark_embedding.py: phash,
+# by far the best hash alone there, counts double, and ahash, psimplehash and
+# whash, the weakest alone, count for less than vertdhash and dhash
+DEFAULT_STAGES = (
+    Stage("phash", 128, 2.0),
+    Stage("vertdhash", 64, 1.0),
+    Stage("dhash", 32, 1.0),
+    Stage("ahash", 32, 0.5),
+    Stage("psimplehash", 16, 0.5),
+    Stage("whash", 16, 0.25),
+)
+
+# Expected distance between unrelated 64-bit hashes, where confidence reaches 0
+UNRELATED_DISTANCE = 32
+
+# orientation: clockwise degrees the query card is turned, from a rotation index
+CascadeMatch = namedtuple("CascadeMatch", ["confidence", "distance", "name", "set", "card_id", "distances",
+                                           "orientation"], defaults=(0,))
+
+
+class CascadeRanker:
+    """
+    Rank cards against several hashes of one query, cheapest filter first.
+
+    Counters record, per stage, how many candidates came in and how many the
+    stage pruned, summed over every rank() call.
+    """
+
+    def __init__(self, search, stages=DEFAULT_STAGES):
+        self.search = search
+        self.stages = [Stage(*stage) for stage in stages]
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.queries = 0
+        self.candidates = [0] * len(self.stages)
+        self.pruned = [0] * len(self.stages)
+
+    def counters(self):
+        """Per-stage (hash_type, candidates in, pruned) totals."""
+        return [(stage.hash_type, self.candidates[i], self.pruned[i]) for i, stage in enumerate(self.stages)]
+
+    @staticmethod
+    def _query_hashes(hashes) -> dict:
+        """Accept a dict by hash type or a sequence in HASH_TYPES order (as getHash returns)."""
+        if isinstance(hashes, dict):
+            return {key: to_uint64(value) for key, value in hashes.items()}
+        return {key: to_uint64(value) for key, value in zip(HASH_TYPES, hashes)}
+
+    def rank(self, hashes, k: int = 10):
+        """
+        Best k cards after every stage, highest confidence first. A stage
+        whose max_distance no survivor meets ends the cascade early, and the
+        survivors so far are ranked instead. On a rotation index each card
+        appears once, in its best orientation.
+        """
+        query = self._query_hashes(hashes)
+        self.queries += 1
+        if k <= 0 or len(self.search) == 0:
+            return []
+        rotated = self.search.orientations is not None
+        rows = None
+        total = None
+        stage_distances = []
+        for i, stage in enumerate(self.stages):
+            # A card's other orientations must not crowd out the k cards
+            keep = max(stage.keep, 4 * k if rotated else k)
+            incoming = len(self.search) if rows is None else len(rows)
+            self.candidates[i] += incoming
+            if rows is None:
+                index = self.search.radius_indexes.get(stage.hash_type)
+                if stage.max_distance is not None and index is not None:
+                    rows, distances = index.within(query[stage.hash_type], stage.max_distance)
+                else:
+                    distances = self.search.distances(query[stage.hash_type], stage.hash_type)
+                    rows = np.arange(len(distances))
+                    if stage.max_distance is not None:
+                        rows = np.flatnonzero(distances <= stage.max_distance)
+                        distances = distances[rows]
+                rows, distances = np.asarray(rows), np.asarray(distances)
+                if len(rows) == 0:
+                    self.pruned[i] += len(self.search)
+                    return []
+                total = stage.weight * distances.astype(np.float64)
+            else:
+                distances = popcount(self.search.column(stage.hash_type)[rows] ^ query[stage.hash_type])
+                if stage.max_distance is not None:
+                    passed = distances <= stage.max_distance
+                    if not passed.any():
+                        break
+                    rows, distances, total = rows[passed], distances[passed], total[passed]
+                    stage_distances = [d[passed] for d in stage_distances]
+                total = total + stage.weight * distances
+            stage_distances.append(distances)
+            if len(rows) > keep:
+                best = np.argpartition(total, keep - 1)[:keep]
+                rows, total = rows[best], total[best]
+                stage_distances = [d[best] for d in stage_distances]
+            self.pruned[i] += incoming - len(rows)
+
+        stages = self.stages[:len(stage_distances)]
+        combined = total / sum(stage.weight for stage in stages)
+        order = np.lexsort((rows, combined))
+        matches = []
+        # (name, set, card id) -> row of its best orientation
+        seen = {}
+        for j in order:
+            if len(matches) >= k:
+                break
+            name, set = self.search.names[rows[j]]
+            card_id = self.search.card_id(rows[j])
+            if rotated:
+                # The other orientations of a card come after its best one
+                if (name, set, card_id) in seen:
+                    continue
+                seen[name, set, card_id] = rows[j]
+            distance = float(combined[j])
+            matches.append(CascadeMatch(
+                max(0.0, 1.0 - distance / UNRELATED_DISTANCE), distance, name, set, card_id,
+                {stage.hash_type: int(d[j]) for stage, d in zip(stages, stage_distances)},
+                self.search.orientation(rows[j]),
+            ))
+        return matches
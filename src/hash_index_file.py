@@ -0,0 +1,172 @@
+# coding=utf-8
+"""
+Compact binary hash index file, opened with numpy.memmap.
+
+Layout (little-endian, every section 8-byte aligned):
+
+    header        magic, version, hash type count, row count, string count,
+                  string data size, CRC32 of everything after the header
+    hash types    16 bytes of ASCII per hash type
+    hashes        uint64 [hash types, rows], one contiguous column per type
+    card ids      int64 [rows], -1 where the row has no id
+    orientations  uint16 [rows], version 2 only: clockwise degrees the card
+                  is turned in the row's hashes (0, 90, 180 or 270)
+    name ids      uint32 [rows], index into the string table
+    set ids       uint32 [rows], index into the string table
+    string table  uint64 offsets [strings + 1] followed by UTF-8 data
+
+Opening the file only maps it, so a query process starts in milliseconds and
+several processes share the same page cache.
+"""
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"GIGHIDX\0"
+# Version 1 files have no orientation section; both are read
+VERSION = 2
+VERSIONS = (1, 2)
+HEADER = struct.Struct("<8sIIQQQI")
+HEADER_SIZE = 64
+TYPE_NAME_SIZE = 16
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def _layout(n_types: int, count: int, n_strings: int, version: int = VERSION):
+    """Byte offset of every section."""
+    offsets = {}
+    position = HEADER_SIZE
+    for section, size in (("types", n_types * TYPE_NAME_SIZE),
+                          ("hashes", n_types * count * 8),
+                          ("card_ids", count * 8),
+                          ("orientations", count * 2 if version >= 2 else 0),
+                          ("name_ids", count * 4),
+                          ("set_ids", count * 4),
+                          ("string_offsets", (n_strings + 1) * 8),
+                          ("strings", 0)):
+        position = _align(position)
+        offsets[section] = position
+        position += size
+    return offsets
+
+
+def write_index_file(path, columns: dict, names, card_ids=None, orientations=None):
+    """
+    Write hash columns (hash type -> uint64 array), the (name, set) of every row,
+    an optional card id column (-1, no id, by default) and optional row
+    orientations to path. Without orientations a version 1 file is written.
+    """
+    names = list(names)
+    count = len(names)
+    hash_types = list(columns)
+    if card_ids is None:
+        card_ids = np.full(count, -1, dtype=np.int64)
+    strings, string_ids = [], {}
+    name_ids = np.empty(count, dtype=np.uint32)
+    set_ids = np.empty(count, dtype=np.uint32)
+    for row, (name, set) in enumerate(names):
+        for ids, value in ((name_ids, name), (set_ids, set)):
+            if value not in string_ids:
+                string_ids[value] = len(strings)
+                strings.append(value)
+            ids[row] = string_ids[value]
+    encoded = [s.encode("utf-8") for s in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(s) for s in encoded], out=string_offsets[1:])
+
+    version = 1 if orientations is None else 2
+    layout = _layout(len(hash_types), count, len(strings), version)
+    sections = [
+        ("types", b"".join(t.encode("ascii").ljust(TYPE_NAME_SIZE, b"\0") for t in hash_types)),
+        ("hashes", b"".join(np.ascontiguousarray(columns[t], dtype="<u8").tobytes() for t in hash_types)),
+        ("card_ids", np.ascontiguousarray(card_ids, dtype="<i8").tobytes()),
+        ("orientations", b"" if orientations is None else np.ascontiguousarray(orientations, dtype="<u2").tobytes()),
+        ("name_ids", name_ids.astype("<u4").tobytes()),
+        ("set_ids", set_ids.astype("<u4").tobytes()),
+        ("string_offsets", string_offsets.tobytes()),
+        ("strings", b"".join(encoded)),
+    ]
+    payload = bytearray()
+    for section, data in sections:
+        payload += b"\0" * (layout[section] - HEADER_SIZE - len(payload))
+        payload += data
+    header = HEADER.pack(MAGIC, version, len(hash_types), count, len(strings),
+                         int(string_offsets[-1]), zlib.crc32(payload))
+
+    tmp_path = str(path) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+class IndexNames:
+    """Lazy (name, set) sequence backed by the string table of an index file."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, row):
+        return self.index.string(self.index.name_ids[row]), self.index.string(self.index.set_ids[row])
+
+
+class HashIndexFile:
+    """Read-only memory-mapped view of an index file written by write_index_file."""
+
+    def __init__(self, path, verify: bool = False):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        if len(self.data) < HEADER_SIZE:
+            raise ValueError(f"{path} is too small to be a hash index file")
+        magic, version, n_types, count, n_strings, string_size, self.crc32 = \
+            HEADER.unpack(self.data[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a hash index file")
+        if version not in VERSIONS:
+            raise ValueError(f"{path} has index version {version}, expected one of {VERSIONS}")
+        layout = _layout(n_types, count, n_strings, version)
+        if len(self.data) != layout["strings"] + string_size:
+            raise ValueError(f"{path} is truncated")
+        if verify:
+            self.verify()
+
+        types = self.data[layout["types"]:layout["types"] + n_types * TYPE_NAME_SIZE].tobytes()
+        self.hash_types = [types[i:i + TYPE_NAME_SIZE].rstrip(b"\0").decode("ascii")
+                           for i in range(0, len(types), TYPE_NAME_SIZE)]
+        hashes = self._section(layout, "hashes", "<u8", n_types * count).reshape(n_types, count)
+        self.columns = {t: hashes[i] for i, t in enumerate(self.hash_types)}
+        self.card_ids = self._section(layout, "card_ids", "<i8", count)
+        self.orientations = self._section(layout, "orientations", "<u2", count) if version >= 2 else None
+        self.name_ids = self._section(layout, "name_ids", "<u4", count)
+        self.set_ids = self._section(layout, "set_ids", "<u4", count)
+        self.string_offsets = self._section(layout, "string_offsets", "<u8", n_strings + 1)
+        self.strings = self.data[layout["strings"]:]
+        self.names = IndexNames(self)
+
+    def _section(self, layout, section, dtype, length):
+        start = layout[section]
+        return self.data[start:start + length * np.dtype(dtype).itemsize].view(dtype)
+
+    def __len__(self):
+        return len(self.card_ids)
+
+    def string(self, i) -> str:
+        start, end = self.string_offsets[i], self.string_offsets[i + 1]
+        return self.strings[start:end].tobytes().decode("utf-8")
+
+    def verify(self):
+        """Check the CRC32 of the payload; raises ValueError on mismatch."""
+        crc = 0
+        step = 1 << 24
+        for start in range(HEADER_SIZE, len(self.data), step):
+            crc = zlib.crc32(self.data[start:start + step], crc)
+        if crc != self.crc32:
+            raise ValueError(f"{self.path} failed its checksum")
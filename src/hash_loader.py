@@ -0,0 +1,130 @@
+# coding=utf-8
+"""
+Batched loader for the binaryhashes and hashes tables.
+
+Rows are buffered and written with parameterized multi-row inserts, both tables
+from the same buffer and inside one transaction per batch, instead of one
+string-built INSERT and one commit per row and table.
+
+Rows are keyed by the path of the image they were hashed from: several
+printings share a (name, set), such as the basic lands of a set, so replacing
+or deleting one image must not touch its siblings.
+"""
+HASH_COLUMNS = "ahash,phash,psimplehash,dhash,vertdhash,whash"
+# "set" is quoted so the same statement also runs on SQLite, where it is a keyword
+COLUMNS = f'path,name,"set",{HASH_COLUMNS}'
+TABLES = ("binaryhashes", "hashes")
+
+
+def hex_to_binary(hashString):
+    return format(int(hashString,16),'0>64b')
+
+
+def _is_psycopg2(con) -> bool:
+    return type(con).__module__.split(".")[0] == "psycopg2"
+
+
+def ensure_path_column(con) -> bool:
+    """
+    Add the path column to tables created before rows were keyed by image.
+    Returns True when every row has a path, False when some predate it and
+    the tables need a full rebuild.
+    """
+    cur = con.cursor()
+    for table in TABLES:
+        if _is_psycopg2(con):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS path text")
+        elif "path" not in [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN path text")
+    cur.execute("SELECT 1 FROM binaryhashes WHERE path IS NULL LIMIT 1")
+    keyed = cur.fetchone() is None
+    con.commit()
+    cur.close()
+    return keyed
+
+
+class HashLoader:
+    """
+    Buffer (path, name, set, hashes) rows and flush them every batch_size rows.
+
+    Works with a psycopg2 connection (execute_values) or any DB-API connection
+    using the qmark paramstyle, such as sqlite3 for local benchmarks. Use as a
+    context manager so the last partial batch is flushed, or rolled back if the
+    build fails.
+    """
+
+    def __init__(self, con, batch_size: int = 1000):
+        self.con = con
+        self.batch_size = batch_size
+        self.rows = []
+        self.deletes = []
+        self.loaded = 0
+        self.deleted = 0
+        self.psycopg2 = _is_psycopg2(con)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.rows = []
+            self.deletes = []
+            self.con.rollback()
+
+    def add(self, path, name, set, hashes, replace: bool = False):
+        """Queue a row; with replace, the existing row of the image at path is deleted first."""
+        if replace:
+            self.deletes.append((path,))
+        self.rows.append((path, name, set, tuple(hashes)))
+        self._maybe_flush()
+
+    def remove(self, path):
+        """Queue deletion of the rows of the image at path from both tables."""
+        self.deletes.append((path,))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.rows) + len(self.deletes) >= self.batch_size:
+            self.flush()
+
+    def _delete(self, cur, table, keys):
+        if self.psycopg2:
+            from psycopg2.extras import execute_batch
+            execute_batch(cur, f'DELETE FROM {table} WHERE path=%s', keys, page_size=len(keys))
+        else:
+            cur.executemany(f'DELETE FROM {table} WHERE path=?', keys)
+
+    def _insert(self, cur, table, rows):
+        if self.psycopg2:
+            from psycopg2.extras import execute_values
+            execute_values(cur, f"INSERT INTO {table} ({COLUMNS}) VALUES %s", rows, page_size=len(rows))
+        else:
+            placeholders = ",".join("?" * len(COLUMNS.split(",")))
+            cur.executemany(f"INSERT INTO {table} ({COLUMNS}) VALUES ({placeholders})", rows)
+
+    def flush(self):
+        """Apply queued deletes, then write every buffered row, in a single transaction."""
+        if not self.rows and not self.deletes:
+            return
+        binary_rows = [(path, name, set, *(hex_to_binary(h) for h in hashes))
+                       for path, name, set, hashes in self.rows]
+        hex_rows = [(path, name, set, *(bytes.fromhex(h) for h in hashes)) for path, name, set, hashes in self.rows]
+        cur = self.con.cursor()
+        try:
+            for table in TABLES:
+                if self.deletes:
+                    self._delete(cur, table, self.deletes)
+                if self.rows:
+                    self._insert(cur, table, binary_rows if table == "binaryhashes" else hex_rows)
+            self.con.commit()
+        except Exception:
+            self.con.rollback()
+            raise
+        finally:
+            cur.close()
+        self.loaded += len(self.rows)
+        self.deleted += len(self.deletes)
+        self.rows = []
+        self.deletes = []
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""
+Manifest of the images already in the hash database.
+
+Records (size, mtime, content digest, name, set) per image path so an
+incremental build only has to stat the tree to find new, changed and removed
+images. The hashes of every rotation (buildBinaryDatabase --rotations) are
+kept too, until the image's content changes.
+"""
+import hashlib
+import json
+import os
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class HashManifest:
+    """JSON manifest keyed by image path."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def scan(self, paths):
+        """
+        Compare paths against the manifest with os.stat only.
+
+        Returns (changed, removed): changed is a list of (path, known_digest)
+        for new images (known_digest None) and images whose size or mtime
+        changed; removed lists manifest paths that are no longer on disk.
+        """
+        changed = []
+        for path in paths:
+            st = os.stat(path)
+            entry = self.entries.get(path)
+            if entry is None:
+                changed.append((path, None))
+            elif entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+                changed.append((path, entry["digest"]))
+        present = set(paths)
+        removed = [path for path in self.entries if path not in present]
+        return changed, removed
+
+    def record(self, path, size, mtime_ns, digest, name=None, set=None):
+        entry = self.entries.setdefault(path, {})
+        if entry.get("digest") != digest:
+            entry.pop("rotations", None)
+        entry.update(size=size, mtime_ns=mtime_ns, digest=digest)
+        if name is not None:
+            entry.update(name=name, set=set)
+
+    def rotations(self, path):
+        """(name, set, hashes per rotation) recorded for an image, or None."""
+        entry = self.entries.get(path)
+        if entry is None or "rotations" not in entry or entry.get("name") is None:
+            return None
+        return entry["name"], entry["set"], entry["rotations"]
+
+    def record_rotations(self, path, name, set, rotations):
+        """Keep the hashes per rotation of an image already in the manifest."""
+        entry = self.entries.get(path)
+        if entry is not None:
+            entry.update(name=name, set=set, rotations=[list(hashes) for hashes in rotations])
+
+    def forget(self, path):
+        return self.entries.pop(path, None)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
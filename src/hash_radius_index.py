@@ -0,0 +1,137 @@
+# coding=utf-8
+"""
+Multi-index hashing over 64-bit perceptual hashes.
+
+Each hash is split into four 16-bit substrings and every substring gets its own
+lookup table (rows sorted by substring value plus a 65536 entry offset array).
+If two hashes are within Hamming distance r, at least one of their substrings
+is within r // 4, so a radius query only probes the buckets close to the query
+substrings and verifies those candidates instead of scanning every row.
+
+A plain popcount scan is already very fast, so the index only pays off on
+large tables (see scripts/benchmark_hash_index.py).
+"""
+from itertools import combinations
+
+import numpy as np
+
+from hash_search import popcount, to_uint64
+
+SUBSTRINGS = 4
+SUBSTRING_BITS = 16
+BUCKETS = 1 << SUBSTRING_BITS
+# Above this per-substring radius probing costs more than a linear scan
+MAX_PROBE_RADIUS = 4
+
+_probe_masks = {}
+
+
+def probe_masks(radius: int) -> np.ndarray:
+    """Every 16-bit mask with at most radius bits set."""
+    if radius not in _probe_masks:
+        masks = [0]
+        for bits in range(1, radius + 1):
+            for positions in combinations(range(SUBSTRING_BITS), bits):
+                masks.append(sum(1 << p for p in positions))
+        _probe_masks[radius] = np.array(masks, dtype=np.int64)
+    return _probe_masks[radius]
+
+
+def substring(hashes, j: int):
+    """j-th 16-bit substring of a uint64 hash or array of hashes."""
+    return (hashes >> np.uint64(SUBSTRING_BITS * j)) & np.uint64(BUCKETS - 1)
+
+
+class MultiIndexHash:
+    """Radius index over one uint64 hash column; results are row numbers into that column."""
+
+    def __init__(self, hashes: np.ndarray, rows: np.ndarray = None, offsets: np.ndarray = None):
+        self.hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        if rows is None or offsets is None:
+            rows, offsets = self._build(self.hashes)
+        self.rows = rows
+        self.offsets = offsets
+        # Hashes in bucket order, so probing a bucket reads contiguous memory
+        self.sorted_hashes = self.hashes[rows]
+
+    @staticmethod
+    def _build(hashes):
+        row_dtype = np.int32 if len(hashes) < 2**31 else np.int64
+        rows = np.empty((SUBSTRINGS, len(hashes)), dtype=row_dtype)
+        offsets = np.zeros((SUBSTRINGS, BUCKETS + 1), dtype=np.int64)
+        for j in range(SUBSTRINGS):
+            keys = substring(hashes, j).astype(np.int64)
+            rows[j] = np.argsort(keys, kind="stable")
+            np.cumsum(np.bincount(keys, minlength=BUCKETS), out=offsets[j, 1:])
+        return rows, offsets
+
+    @classmethod
+    def from_search(cls, search, hash_type):
+        """Index one column of a HashSearch (the data getValuesFromDb loads)."""
+        return cls(search.column(hash_type))
+
+    def save(self, path):
+        np.savez(path, hashes=self.hashes, rows=self.rows, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["hashes"], data["rows"], data["offsets"])
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def probe_radii(self, radius: int):
+        """
+        Per-substring probe radius. With radius = 4 * s + a, a match is within s
+        on one of the first a + 1 substrings or within s - 1 on one of the others.
+        """
+        s, a = divmod(radius, SUBSTRINGS)
+        return [s if j <= a else s - 1 for j in range(SUBSTRINGS)]
+
+    def _probe(self, query, radius: int):
+        """(rows, distances) of probed candidates; rows can repeat across substrings."""
+        found_rows, found_distances = [], []
+        for j, probe_radius in enumerate(self.probe_radii(radius)):
+            if probe_radius < 0:
+                continue
+            probes = int(substring(query, j)) ^ probe_masks(probe_radius)
+            starts = self.offsets[j, probes]
+            lengths = self.offsets[j, probes + 1] - starts
+            total = int(lengths.sum())
+            if total == 0:
+                continue
+            # Concatenate every probed bucket without a Python loop over buckets
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+            distances = popcount(self.sorted_hashes[j, positions] ^ query)
+            keep = distances <= radius
+            found_rows.append(self.rows[j, positions[keep]])
+            found_distances.append(distances[keep])
+        if not found_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        return np.concatenate(found_rows), np.concatenate(found_distances)
+
+    def candidates(self, query, radius: int) -> int:
+        """Number of rows a radius query verifies (before deduplication)."""
+        query = to_uint64(query)
+        total = 0
+        for j, probe_radius in enumerate(self.probe_radii(radius)):
+            if probe_radius >= 0:
+                probes = int(substring(query, j)) ^ probe_masks(probe_radius)
+                total += int((self.offsets[j, probes + 1] - self.offsets[j, probes]).sum())
+        return total
+
+    def within(self, query, radius: int):
+        """(rows, distances) of every hash within radius of query, nearest first."""
+        query = to_uint64(query)
+        if radius // SUBSTRINGS > MAX_PROBE_RADIUS:
+            rows = np.arange(len(self.hashes))
+            distances = popcount(self.hashes ^ query)
+            keep = distances <= radius
+            rows, distances = rows[keep], distances[keep]
+        else:
+            rows, distances = self._probe(query, radius)
+            rows, first = np.unique(rows, return_index=True)
+            distances = distances[first]
+        order = np.lexsort((rows, distances))
+        return rows[order], distances[order]
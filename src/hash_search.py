@@ -0,0 +1,257 @@
+# coding=utf-8
+"""
+Vectorized Hamming search over packed 64-bit perceptual hashes.
+
+Every hash column is kept as one contiguous numpy uint64 array, so a query is a
+single XOR + popcount over the whole column instead of a Python loop comparing
+'0'/'1' strings character by character.
+"""
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# Column order of the binaryhashes / hashes tables
+HASH_TYPES = ("ahash", "phash", "psimplehash", "dhash", "vertdhash", "whash")
+
+# card_id is the multiverse id when the index carries one for the row, otherwise None;
+# orientation is how many degrees clockwise the query card is turned
+Match = namedtuple("Match", ["distance", "name", "set", "card_id", "orientation"], defaults=(None, 0))
+
+
+if hasattr(np, "bitwise_count"):
+    def popcount(values: np.ndarray) -> np.ndarray:
+        """Number of set bits of every element of a uint64 array."""
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(values: np.ndarray) -> np.ndarray:
+        """Number of set bits of every element of a uint64 array."""
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        counts = _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,))
+        return counts.sum(axis=-1, dtype=np.uint8)
+
+
+def to_uint64(value) -> np.uint64:
+    """
+    Convert one hash to a uint64.
+
+    Accepts a 64 character '0'/'1' string (binaryhashes), a hex string
+    (hashes / str(ImageHash)), an ImageHash or an integer.
+    """
+    if isinstance(value, (int, np.integer)):
+        return np.uint64(value)
+    if not isinstance(value, (str, bytes)):
+        value = str(value)
+    if isinstance(value, bytes):
+        return np.uint64(int.from_bytes(value, "big"))
+    value = value.strip()
+    if len(value) == 64 and set(value) <= {"0", "1"}:
+        return np.uint64(int(value, 2))
+    return np.uint64(int(value, 16))
+
+
+def pack_binary_strings(strings) -> np.ndarray:
+    """Pack a sequence of 64 character '0'/'1' strings into a uint64 array."""
+    strings = list(strings)
+    if not strings:
+        return np.zeros(0, dtype=np.uint64)
+    joined = "".join(strings)
+    if len(joined) != 64 * len(strings) or any(len(s) != 64 for s in strings):
+        raise ValueError("Every binary hash must be exactly 64 characters long")
+    bits = np.frombuffer(joined.encode("ascii"), dtype=np.uint8).reshape(-1, 64) - ord("0")
+    if bits.max() > 1:
+        raise ValueError("Binary hashes may only contain '0' and '1'")
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def pack_hashes(values) -> np.ndarray:
+    """Pack a sequence of hashes in any format accepted by to_uint64."""
+    values = list(values)
+    if values and all(isinstance(v, str) and len(v) == 64 for v in values):
+        return pack_binary_strings(values)
+    return np.array([to_uint64(v) for v in values], dtype=np.uint64)
+
+
+def hamming_distance(a, b) -> int:
+    """Hamming distance between two hashes in any format accepted by to_uint64."""
+    return int(popcount(np.array([to_uint64(a) ^ to_uint64(b)], dtype=np.uint64))[0])
+
+
+class HashSearch:
+    """
+    In-memory search engine over the perceptual hashes of every card.
+
+    columns maps a hash type (see HASH_TYPES) to a uint64 array, names holds
+    the (name, set) of each row in the same order and card_ids an optional id
+    per row. A rotation index (see buildBinaryDatabase --rotations) holds one
+    row per card and orientation, with orientations giving the clockwise
+    degrees of each row.
+    """
+
+    def __init__(self, columns: dict, names, card_ids=None, orientations=None):
+        self.columns = {key: np.ascontiguousarray(col, dtype=np.uint64) for key, col in columns.items()}
+        # Sequences (lists, lazy index file names) are used as they are
+        self.names = names if hasattr(names, "__getitem__") and hasattr(names, "__len__") else list(names)
+        self.card_ids = card_ids
+        self.orientations = orientations
+        for key, col in self.columns.items():
+            if len(col) != len(self.names):
+                raise ValueError(f"Column {key} has {len(col)} rows but there are {len(self.names)} names")
+        self.radius_indexes = {}
+
+    @classmethod
+    def from_rows(cls, rows, hash_types=HASH_TYPES):
+        """Build from (name, set, hash_1, ..., hash_n) rows as returned by the database."""
+        rows = list(rows)
+        names = [(row[0], row[1]) for row in rows]
+        columns = {key: pack_hashes(row[2 + i] for row in rows) for i, key in enumerate(hash_types)}
+        return cls(columns, names)
+
+    @classmethod
+    def from_db(cls, cur, table="binaryhashes", hash_types=HASH_TYPES):
+        """
+        Load every row of the binaryhashes (or hashes) table in a single query,
+        from Postgres or SQLite ("set" is quoted, it is a keyword in SQLite).
+        """
+        cur.execute(f'select name,"set",{",".join(hash_types)} from {table}')
+        return cls.from_rows(cur.fetchall(), hash_types)
+
+    @classmethod
+    def from_index_file(cls, path, verify: bool = False):
+        """Memory-map an index file written by hash_index_file.write_index_file."""
+        from hash_index_file import HashIndexFile
+
+        index = HashIndexFile(path, verify)
+        return cls(index.columns, index.names, index.card_ids, index.orientations)
+
+    def write_index_file(self, path):
+        from hash_index_file import write_index_file
+
+        write_index_file(path, self.columns, (self.names[i] for i in range(len(self))), self.card_ids,
+                         self.orientations)
+
+    def __len__(self):
+        return len(self.names)
+
+    def orientation(self, row) -> int:
+        return 0 if self.orientations is None else int(self.orientations[row])
+
+    @staticmethod
+    def _key(hash_type) -> str:
+        if isinstance(hash_type, (int, np.integer)):
+            return HASH_TYPES[hash_type]
+        return hash_type
+
+    def column(self, hash_type) -> np.ndarray:
+        """Hash column by name or by its position in HASH_TYPES."""
+        return self.columns[self._key(hash_type)]
+
+    def build_radius_index(self, hash_type, path=None):
+        """
+        Build a multi-index hash over one column, or load it from path when
+        the saved index still matches the column. within() uses it for that
+        column from then on.
+        """
+        from hash_radius_index import MultiIndexHash
+
+        key = self._key(hash_type)
+        index = None
+        if path is not None and os.path.exists(path):
+            index = MultiIndexHash.load(path)
+            if not np.array_equal(index.hashes, self.columns[key]):
+                index = None
+        if index is None:
+            index = MultiIndexHash(self.columns[key])
+            if path is not None:
+                index.save(path)
+        self.radius_indexes[key] = index
+        return index
+
+    def distances(self, query, hash_type) -> np.ndarray:
+        """Hamming distance from query to every row of one hash column."""
+        return popcount(self.column(hash_type) ^ to_uint64(query))
+
+    def card_id(self, row):
+        """Card id of a row, None when the index has none for it (stored as -1)."""
+        if self.card_ids is None or self.card_ids[row] < 0:
+            return None
+        return int(self.card_ids[row])
+
+    def _match(self, row, distance) -> Match:
+        return Match(int(distance), *self.names[row], self.card_id(row), self.orientation(row))
+
+    def _matches(self, distances: np.ndarray, rows: np.ndarray):
+        return [self._match(i, distances[i]) for i in rows]
+
+    def within(self, query, hash_type, radius: int):
+        """Every row within Hamming distance radius of query, nearest first."""
+        index = self.radius_indexes.get(self._key(hash_type))
+        if index is not None:
+            rows, distances = index.within(query, radius)
+            return [self._match(i, d) for i, d in zip(rows, distances)]
+        distances = self.distances(query, hash_type)
+        rows = np.flatnonzero(distances <= radius)
+        rows = rows[np.argsort(distances[rows], kind="stable")]
+        return self._matches(distances, rows)
+
+    def top_k(self, query, hash_type, k: int = 10):
+        """The k nearest rows to query, nearest first."""
+        distances = self.distances(query, hash_type)
+        k = min(k, len(distances))
+        if k <= 0:
+            return []
+        rows = np.argpartition(distances, k - 1)[:k]
+        rows = rows[np.lexsort((rows, distances[rows]))]
+        return self._matches(distances, rows)
+
+    def top_k_batch(self, queries, hash_type, k: int = 10, block_queries: int = 32, block_rows: int = 4096,
+                    seed_rows: int = 1 << 16):
+        """
+        The k nearest rows for each of M queries, as a list of M Match lists.
+
+        The M x N distance matrix is computed in cache-sized block_queries x
+        block_rows tiles into preallocated buffers, so memory stays bounded by
+        one tile whatever M and N are. The k-th smallest distance over the
+        first seed_rows rows bounds each query's final k-th distance, so the
+        full scan only keeps the few rows at or below that bound.
+        """
+        column = self.column(hash_type)
+        queries = np.array([to_uint64(q) for q in queries], dtype=np.uint64)
+        k = min(k, len(column))
+        if k <= 0:
+            return [[] for _ in queries]
+        xor = np.empty((block_queries, block_rows), dtype=np.uint64)
+        distances = np.empty((block_queries, block_rows), dtype=np.uint8)
+        keep = np.empty((block_queries, block_rows), dtype=bool)
+
+        def tile(block, start):
+            width = min(block_rows, len(column) - start)
+            x, d = xor[:len(block), :width], distances[:len(block), :width]
+            np.bitwise_xor(block, column[None, start:start + width], out=x)
+            d[...] = popcount(x)
+            return d
+
+        results = []
+        for q_start in range(0, len(queries), block_queries):
+            block = queries[q_start:q_start + block_queries, None]
+            seed = np.concatenate([tile(block, start).copy()
+                                   for start in range(0, min(seed_rows, len(column)), block_rows)], axis=1)
+            bound = np.partition(seed, k - 1, axis=1)[:, k - 1:k]
+
+            found_queries, found_rows, found_distances = [], [], []
+            for start in range(0, len(column), block_rows):
+                d = tile(block, start)
+                mask = keep[:len(block), :d.shape[1]]
+                np.less_equal(d, bound, out=mask)
+                query_ids, rows = np.nonzero(mask)
+                found_queries.append(query_ids)
+                found_rows.append(rows + start)
+                found_distances.append(d[query_ids, rows])
+            query_ids, rows, found = (np.concatenate(f) for f in (found_queries, found_rows, found_distances))
+            order = np.lexsort((rows, found, query_ids))
+            query_ids, rows, found = query_ids[order], rows[order], found[order]
+            for start in np.searchsorted(query_ids, np.arange(len(block))):
+                results.append([self._match(row, d) for row, d in zip(rows[start:start + k], found[start:start + k])])
+        return results
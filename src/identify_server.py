@@ -0,0 +1,275 @@
+# coding=utf-8
+"""
+Resident card identification service.
+
+Loads the memory-mapped hash index once and answers identification requests
+over local HTTP (TCP or a Unix socket), fully offline:
+
+    POST /identify/image   body: card image bytes            -> ranked matches
+                           ?photo=1: a photo, the card is detected and warped
+    POST /identify/hash    body: {"hashes": [6 hex hashes]}  -> ranked matches
+                           or    {"hash": "...", "hash_type": "phash"}
+    GET  /metrics          Prometheus text: latency histograms and counters
+    GET  /health
+
+Every identify endpoint accepts ?k=N (default 10). With --metadata every
+match carries the card's Scryfall metadata, looked up by multiverse id.
+
+    python src/identify_server.py --index data/hash_index.bin --port 8765
+    python src/identify_server.py --unix /tmp/identify.sock
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from card_metadata import CardMetadata
+from hash_cascade import CascadeRanker
+from hash_search import HASH_TYPES, HashSearch
+
+INDEX_PATH = "data/hash_index.bin"
+METADATA_PATH = "data/card_metadata.sqlite"
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+MAX_BODY_BYTES = 32 * 1024 * 1024
+# Metric label of every path; any other path is counted as "other", so
+# requests for unknown paths can't create new series
+ENDPOINTS = ("/identify/image", "/identify/hash", "/metrics", "/health")
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram, safe to update from handler threads."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self.lock:
+            self.total += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+
+    def prometheus(self, name: str, labels: str):
+        with self.lock:
+            counts, total = list(self.counts), self.total
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {total}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.latency = {}
+        self.responses = {}
+        self.lock = threading.Lock()
+
+    def observe(self, endpoint: str, status: int, seconds: float):
+        with self.lock:
+            histogram = self.latency.setdefault(endpoint, LatencyHistogram())
+            key = (endpoint, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+        histogram.observe(seconds)
+
+    def prometheus(self) -> str:
+        with self.lock:
+            latency = dict(self.latency)
+            responses = dict(self.responses)
+        lines = ["# TYPE identify_request_seconds histogram"]
+        for endpoint, histogram in sorted(latency.items()):
+            lines += histogram.prometheus("identify_request_seconds", f'endpoint="{endpoint}"')
+        lines.append("# TYPE identify_responses_total counter")
+        for (endpoint, status), count in sorted(responses.items()):
+            lines.append(f'identify_responses_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+        elapsed = max(time.time() - self.started, 1e-9)
+        lines.append("# TYPE identify_requests_per_second gauge")
+        lines.append(f"identify_requests_per_second {sum(responses.values()) / elapsed}")
+        return "\n".join(lines) + "\n"
+
+
+class Identifier:
+    """Owns the in-memory index and answers queries; shared by every handler thread."""
+
+    def __init__(self, search: HashSearch, metadata: CardMetadata = None):
+        self.search = search
+        self.metadata = metadata
+        self.lock = threading.Lock()
+        self.ranker = CascadeRanker(search)
+
+    def _result(self, match) -> dict:
+        return self.metadata.enrich(match) if self.metadata is not None else match._asdict()
+
+    def identify_hashes(self, hashes, k: int):
+        # The ranker's counters are not thread-safe, the scan itself is short
+        with self.lock:
+            matches = self.ranker.rank(hashes, k)
+        return [self._result(match) for match in matches]
+
+    def identify_hash(self, value, hash_type: str, k: int):
+        return [self._result(match) for match in self.search.top_k(value, hash_type, k)]
+
+    def identify_image(self, data: bytes, k: int):
+        from rotateCrop import getHash
+
+        hashes = getHash(io.BytesIO(data))
+        return dict(zip(HASH_TYPES, hashes)), self.identify_hashes(hashes, k)
+
+    def identify_photo(self, data: bytes, k: int):
+        import cv2
+        import numpy as np
+        from rotateCrop import detectCards, hashCard, warpCard
+
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Could not decode the photo")
+        detection = detectCards(img)
+        if not detection.contours:
+            return {}, []
+        hashes = hashCard(warpCard(img, detection.contours[0], detection.scale))
+        return dict(zip(HASH_TYPES, hashes)), self.identify_hashes(hashes, k)
+
+
+class IdentifyHandler(BaseHTTPRequestHandler):
+    server_version = "CardIdentify/1.0"
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status: int, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"Request body larger than {MAX_BODY_BYTES} bytes")
+        return self.rfile.read(length)
+
+    def _timed(self, handler):
+        start = time.perf_counter()
+        endpoint = urllib.parse.urlparse(self.path).path
+        try:
+            status = handler(endpoint)
+        except (ValueError, KeyError, OSError) as e:
+            status = self._send(400, {"error": str(e)})
+        except Exception as e:
+            logging.exception(f"Error handling {endpoint}")
+            status = self._send(500, {"error": str(e)})
+        label = endpoint if endpoint in ENDPOINTS else "other"
+        self.server.metrics.observe(label, status, time.perf_counter() - start)
+
+    def do_GET(self):
+        def handle(endpoint):
+            if endpoint == "/metrics":
+                return self._send(200, self.server.metrics.prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+            if endpoint == "/health":
+                return self._send(200, {"status": "ok", "cards": len(self.server.identifier.search)})
+            return self._send(404, {"error": f"Unknown endpoint {endpoint}"})
+        self._timed(handle)
+
+    def do_POST(self):
+        def handle(endpoint):
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            k = int(query.get("k", [10])[0])
+            identifier = self.server.identifier
+            start = time.perf_counter()
+            if endpoint == "/identify/image" and query.get("photo", ["0"])[0] not in ("0", ""):
+                hashes, matches = identifier.identify_photo(self._body(), k)
+            elif endpoint == "/identify/image":
+                hashes, matches = identifier.identify_image(self._body(), k)
+            elif endpoint == "/identify/hash":
+                request = json.loads(self._body() or b"{}")
+                k = int(request.get("k", k))
+                if "hashes" in request:
+                    hashes = request["hashes"]
+                    matches = identifier.identify_hashes(hashes, k)
+                else:
+                    hashes = {request.get("hash_type", "phash"): request["hash"]}
+                    matches = identifier.identify_hash(request["hash"], request.get("hash_type", "phash"), k)
+            else:
+                return self._send(404, {"error": f"Unknown endpoint {endpoint}"})
+            return self._send(200, {
+                "hashes": hashes,
+                "matches": matches,
+                "elapsed_ms": 1e3 * (time.perf_counter() - start),
+            })
+        self._timed(handle)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(identifier: Identifier, host="127.0.0.1", port=8765, unix_socket=None):
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = UnixHTTPServer(unix_socket, IdentifyHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), IdentifyHandler)
+    server.identifier = identifier
+    server.metrics = Metrics()
+    return server
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=INDEX_PATH, help=f"hash index file (default: {INDEX_PATH})")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="serve on this Unix socket instead of TCP")
+    parser.add_argument("--radius-index", action="store_true",
+                        help="build radius indexes for every hash type (pays off on large indexes)")
+    parser.add_argument("--metadata", default=METADATA_PATH,
+                        help=f"card_metadata table used to enrich matches, if present (default: {METADATA_PATH})")
+    args = parser.parse_args()
+
+    search = HashSearch.from_index_file(args.index)
+    if args.radius_index:
+        for hash_type in search.columns:
+            search.build_radius_index(hash_type)
+    metadata = CardMetadata(args.metadata) if os.path.exists(args.metadata) else None
+    if metadata is not None:
+        logging.info(f"Enriching matches with the metadata of {len(metadata)} cards from {args.metadata}")
+    server = make_server(Identifier(search, metadata), args.host, args.port, args.unix)
+    where = args.unix or f"http://{args.host}:{args.port}"
+    logging.info(f"Serving {len(search)} cards from {args.index} on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@ from google import genai
 from google.genai import types
 import json
 import cv2 as cv
-import numpy as np
 import os
 import backoff
 from pathlib import Path
@@ -18,6 +17,7 @@ from typing import Dict
 from tqdm.asyncio import tqdm_asyncio
 import unicodedata
 from write_captions import clean_unicode, generate_caption_from_metadata, cut_caption
+from art_crops import CAPTION_ART_BOX, crop_art
 
 
 SYSTEM_PROMPT = """
@@ -188,32 +188,12 @@ class CardArtCaptioner:
 
         return json.loads(response.text)
     
-    def _crop_image_art(self, img: Image) -> np.ndarray:
+    def _crop_image_art(self, img: Image) -> Image:
         """
         Cut out the box art from the image.
         """
-
-        # Define the box art area (example coordinates)
-        # size = (370, 265, 3)
-        left = 20
-        top = 40
-        right = img.width - left
-        bottom = img.height - 160
-
-        # Crop the image to the box art area
-        box_art = img.crop((left, top, right, bottom))
-
-            # Use proportional values
-        left = int(img.width * 0.07)
-        top = int(img.height * 0.11)
-        right = int(img.width * 0.93)
-        bottom = int(img.height * 0.56)
-
-        box_art = img.crop((left, top, right, bottom))
-
-        return box_art
+        return crop_art(img, CAPTION_ART_BOX)
     
-
     def _generate_caption(self, image_path: Path, caption: str, card_data: dict) -> bool:
         """Generate the final caption combining model output and card data"""
 
@@ -10,6 +10,7 @@ from torchvision.transforms.functional import InterpolationMode
 from transformers import AutoModel, AutoTokenizer
 from tqdm.asyncio import tqdm_asyncio
 from write_captions import clean_unicode, generate_caption_from_metadata, cut_caption
+from art_crops import CAPTION_ART_BOX, crop_art
 
 # Configure logging
 logging.basicConfig(
@@ -223,14 +224,7 @@ class InternVLCardArtCaptioner:
 
     def _crop_image_art(self, img: Image) -> Image:
         """Cut out the box art from the image."""
-        # Use proportional values
-        left = int(img.width * 0.07)
-        top = int(img.height * 0.11)
-        right = int(img.width * 0.93)
-        bottom = int(img.height * 0.56)
-
-        box_art = img.crop((left, top, right, bottom))
-        return box_art
+        return crop_art(img, CAPTION_ART_BOX)
 
     async def _analyze_image(self, image_path: Path, card_data: dict) -> str:
         """Analyze single image with InternVL"""
@@ -1,162 +1,394 @@
+"""
+Async Gatherer scraper: card images plus their Scryfall metadata sidecars.
+
+One engine for the whole catalogue. Every request goes through a single
+aiohttp session whose connector is the shared connection pool, a global
+semaphore bounds the requests in flight, and each host gets its own rate
+limit. The work is split in pluggable stages:
+
+    discover(scraper, set_name)           async iterator of multiverse ids
+    download(scraper, multiverse_id, path) fetch, validate and save the image
+    metadata(scraper, multiverse_id, path) write the .json sidecar
+
+Sets are scraped through one work queue: up to `discoverers` sets fetch
+their search pages at once and feed the cards they find to `workers`
+download tasks shared by every set, so page round trips overlap with
+downloads. A report is logged as each set completes.
+
+    python src/image_scraper.py --concurrency 16 --workers 32
+"""
+import argparse
+import asyncio
+import io
+import logging
+import ssl
+import time
+import urllib.parse
+from collections import namedtuple
+from pathlib import Path
+
 import aiohttp
-from aiohttp import ClientSession, ClientTimeout
+import yaml
+from aiohttp import ClientTimeout
 from bs4 import BeautifulSoup, FeatureNotFound
-from pathlib import Path
 from PIL import Image, UnidentifiedImageError
-import yaml
-import urllib.parse
-import logging
-import ssl
-from write_captions import save_metadata
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('image_scraping.log'),
-        logging.StreamHandler()
-    ]
-)
+
+from scryfall_bulk import BulkIndex
+from write_captions import COLLECTION_SIZE, FLUSH_INTERVAL, ScryfallClient
 
 # Constants
 BASE_URL = "https://gatherer.wizards.com"
+SEARCH_URL = BASE_URL + "/Pages/Search/Default.aspx?page={}&set=[%22{}%22]"
 IMAGE_URL = BASE_URL + "/Handlers/Image.ashx?multiverseid={}&type=card"
 DATA_DIR = Path("data/images")
 CONFIG_PATH = Path("config/expansions.yaml")
+LEGACY_CONFIG_PATH = Path("config/cardSets.txt")
 TIMEOUT = ClientTimeout(total=30)
 HEADERS = {"User-Agent": "Mozilla/5.0"}
 MAX_RETRIES = 3
+# Hardcoded based on the biggest set 'Fifth Edition' with 449 cards
+MAX_PAGES = 5
+
+# Requests in flight over every host
+CONCURRENCY = 16
+# Requests per second per host; Scryfall asks for 50-100 ms between requests
+HOST_RATES = {"gatherer.wizards.com": 20.0, "api.scryfall.com": 10.0}
+DEFAULT_RATE = 10.0
+# Download tasks shared by every set, and sets discovering their pages at once
+WORKERS = 32
+DISCOVERERS = 8
+
+SetReport = namedtuple("SetReport", ["set_name", "downloaded", "failed", "skipped", "seconds"])
+
+
+class RateLimiter:
+    """Spaces the requests to one host at least 1 / rate seconds apart."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next = 0.0
+        self.last_sent = float("-inf")
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        # Reserve the next slot under the lock, sleep outside it
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            start = max(now, self.next)
+            self.next = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def send(self):
+        """
+        Wait until interval after the last request actually sent, and record
+        this one as sent. A slot reserved by wait() can pass while the request
+        waits for a connection, so requests freed together would burst.
+        """
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            start = max(now, self.last_sent + self.interval)
+            self.last_sent = start
+            self.next = max(self.next, start + self.interval)
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class SetProgress:
+    """Counters of one set in the work queue; complete once discovered and drained."""
+
+    def __init__(self, set_name: str):
+        self.set_name = set_name
+        self.start = time.perf_counter()
+        self.discovered = False
+        self.pending = self.downloaded = self.failed = self.skipped = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.discovered and self.pending == 0
+
+    def report(self) -> SetReport:
+        return SetReport(self.set_name, self.downloaded, self.failed, self.skipped,
+                         time.perf_counter() - self.start)
+
+
+class Scraper:
+    """
+    Shared session, concurrency limit and per-host rate limits, plus the
+    stages run for every set. Use as an async context manager.
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, host_rates=None, discover=None, download=None, metadata=None,
+                 data_dir=DATA_DIR, verify_ssl=False, scryfall_url=None, bulk_index=None,
+                 metadata_batch=COLLECTION_SIZE, metadata_interval=FLUSH_INTERVAL):
+        self.concurrency = concurrency
+        self.host_rates = dict(HOST_RATES, **(host_rates or {}))
+        self.discover = discover or discover_gatherer
+        self.download = download or save_image
+        self.metadata = metadata or save_metadata_sidecar
+        self.scryfall = ScryfallClient(self.request, scryfall_url, bulk_index, metadata_batch, metadata_interval)
+        self.data_dir = Path(data_dir)
+        self.verify_ssl = verify_ssl
+        self.semaphore = None
+        self.limiters = {}
+        self.session = None
+
+    async def __aenter__(self):
+        sslcontext = ssl.create_default_context()
+        if not self.verify_ssl:
+            sslcontext.check_hostname = False
+            sslcontext.verify_mode = ssl.CERT_NONE
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ssl=sslcontext, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(timeout=TIMEOUT, headers=HEADERS, connector=connector)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
 
+    def limiter(self, host: str) -> RateLimiter:
+        if host not in self.limiters:
+            self.limiters[host] = RateLimiter(self.host_rates.get(host, DEFAULT_RATE))
+        return self.limiters[host]
 
-# Validate and save image
-async def save_image(session: ClientSession, url: str, path: Path, multiverse_id: str):
+    async def request(self, method: str, url: str, kind="text", **kwargs):
+        """
+        Body of a 200 response as text, bytes ("bytes") or parsed JSON ("json"),
+        or None. Connection errors, 429 and 5xx responses are retried with
+        backoff; other statuses are returned as None right away.
+        """
+        limiter = self.limiter(urllib.parse.urlparse(url).hostname)
+        for attempt in range(MAX_RETRIES):
+            # Wait for the host's slot before taking a connection slot, so
+            # requests queued behind a slow host don't starve the others, then
+            # space the send itself in case the slot passed while queued
+            await limiter.wait()
+            async with self.semaphore:
+                await limiter.send()
+                try:
+                    async with self.session.request(method, url, **kwargs) as resp:
+                        if resp.status == 200:
+                            if kind == "bytes":
+                                return await resp.read()
+                            if kind == "json":
+                                return await resp.json()
+                            return await resp.text()
+                        if resp.status != 429 and resp.status < 500:
+                            logging.error(f"Failed to fetch {url} — status {resp.status}")
+                            return None
+                        reason = f"status {resp.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    reason = repr(e)
+            if attempt < MAX_RETRIES - 1:
+                logging.warning(f"Retry {attempt+1} for {url} due to: {reason}")
+                await asyncio.sleep(2 ** attempt)
+        logging.error(f"Exception fetching {url} after {MAX_RETRIES} attempts: {reason}")
+        return None
+
+    async def get(self, url: str, kind="text"):
+        return await self.request("GET", url, kind)
+
+    def set_folder(self, set_name: str) -> Path:
+        folder = self.data_dir / set_name.replace(" ", "_")
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+    async def scrape(self, sets, workers=WORKERS, discoverers=DISCOVERERS):
+        """
+        Scrape every set through one producer/consumer queue; returns a
+        SetReport per set, in completion order. The bounded queue holds the
+        discoverers back when the download workers fall behind.
+        """
+        queue = asyncio.Queue(maxsize=2 * workers)
+        slots = asyncio.Semaphore(discoverers)
+        reports = []
+
+        def done(progress):
+            if progress.complete:
+                report = progress.report()
+                reports.append(report)
+                logging.info(f"{report.set_name}: {report.downloaded} downloaded, {report.failed} failed, "
+                             f"{report.skipped} already present in {report.seconds:.1f}s")
+
+        async def produce(progress):
+            try:
+                async with slots:
+                    logging.info(f"Processing set: {progress.set_name}")
+                    progress.start = time.perf_counter()
+                    folder = self.set_folder(progress.set_name)
+                    async for multiverse_id in self.discover(self, progress.set_name):
+                        img_path = folder / f"{multiverse_id}.jpg"
+                        if img_path.exists():
+                            progress.skipped += 1
+                            continue
+                        progress.pending += 1
+                        await queue.put((progress, multiverse_id, img_path))
+            finally:
+                progress.discovered = True
+                done(progress)
+
+        async def consume():
+            while True:
+                progress, multiverse_id, img_path = await queue.get()
+                try:
+                    ok = await self.download(self, multiverse_id, img_path)
+                except Exception as e:
+                    logging.error(f"Error downloading {img_path}: {e}")
+                    ok = False
+                progress.downloaded += bool(ok)
+                progress.failed += not ok
+                progress.pending -= 1
+                done(progress)
+                queue.task_done()
+
+        consumers = [asyncio.create_task(consume()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*(produce(SetProgress(name)) for name in dict.fromkeys(sets)))
+            await queue.join()
+        finally:
+            for consumer in consumers:
+                consumer.cancel()
+            await asyncio.gather(*consumers, return_exceptions=True)
+        return reports
+
+    async def scrape_set(self, set_name: str) -> SetReport:
+        """Download every new card of one set."""
+        return (await self.scrape([set_name]))[0]
+
+
+def parse_multiverse_ids(html: str):
+    """Multiverse ids of the cards listed on one Gatherer search page, in page order."""
+    try:
+        soup = BeautifulSoup(html, "lxml")
+    except FeatureNotFound:
+        soup = BeautifulSoup(html, "html.parser")
+    ids = []
+    for span in soup.find_all("span", class_="cardTitle"):
+        link = span.find("a")
+        if link and link.get("href"):
+            query = urllib.parse.urlparse(link["href"]).query
+            multiverse_id = urllib.parse.parse_qs(query).get("multiverseid", [None])[0]
+            if multiverse_id:
+                ids.append(multiverse_id)
+    return ids
+
+
+async def discover_gatherer(scraper: Scraper, set_name: str):
+    """Page discovery stage: the multiverse ids on the search pages of one set."""
+    seen_ids = set()
+    for page in range(MAX_PAGES):
+        html = await scraper.get(SEARCH_URL.format(page, urllib.parse.quote(set_name)))
+        new_ids = [i for i in parse_multiverse_ids(html or "") if i not in seen_ids]
+        # Past the last page Gatherer repeats it
+        if not new_ids:
+            break
+        seen_ids.update(new_ids)
+        for multiverse_id in new_ids:
+            yield multiverse_id
+
+
+def write_jpeg(content: bytes, path: Path):
+    """Validate downloaded image bytes and save them as RGB JPEG (drops problematic color profiles)."""
+    with Image.open(io.BytesIO(content)) as img:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(path, 'JPEG')
+
+
+async def save_image(scraper: Scraper, multiverse_id: str, path: Path):
+    """Download stage: image, then its metadata; nothing is kept unless both succeed."""
+    url = IMAGE_URL.format(multiverse_id)
     for attempt in range(MAX_RETRIES):
+        content = await scraper.get(url, "bytes")
+        if content is None:
+            return False
         try:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    content = await resp.read()
-                    # path.write_bytes(content)
-                    # Create a BytesIO object to handle the image in memory
-                    from io import BytesIO
-                    image_data = BytesIO(content)
-
-                    # Validate image
-                    try:
-                        # with Image.open(path) as img:
-                        #     img.verify()
-
-                        # Open image from memory and convert to RGB to fix profile issues
-                        with Image.open(image_data) as img:
-                            # Convert to RGB (removes problematic color profiles)
-                            if img.mode != 'RGB':
-                                img = img.convert('RGB')
-                            # Save as JPG with good quality
-                            img.save(path, 'JPEG')
-
-                    except (UnidentifiedImageError, OSError) as e:
-                        logging.warning(f"Corrupted image at {path.name}, removing.")
-                        path.unlink()
-                        if attempt < MAX_RETRIES - 1:
-                            logging.warning(f"Retry {attempt+1} for {url} due to corrupted image: {e}")
-                            continue
-                        else:
-                            logging.error(f"Corrupted image after {MAX_RETRIES} attempts: {e}")
-                            return False
-
-                    caption_created = save_metadata(multiverse_id, str(path))
-                    
-                    if not caption_created:
-                        logging.error(f"Failed to create caption for {path.name}")
-                        path.unlink()
-                        return False
-                    
-                    logging.info(f"Downloaded: {path.name}")
-                    return True
-                else:
-                    logging.error(f"Failed to fetch {url} — status {resp.status}")
-                    return False
-        except Exception as e:
+            # Decoding and encoding are CPU work, keep them off the event loop
+            await asyncio.to_thread(write_jpeg, content, path)
+            break
+        except (UnidentifiedImageError, OSError) as e:
+            path.unlink(missing_ok=True)
             if attempt < MAX_RETRIES - 1:
-                logging.warning(f"Retry {attempt+1} for {url} due to: {e}")
-                continue
+                logging.warning(f"Retry {attempt+1} for {url} due to corrupted image: {e}")
             else:
-                logging.error(f"Exception fetching {url} after {MAX_RETRIES} attempts: {e}")
+                logging.error(f"Corrupted image after {MAX_RETRIES} attempts: {e}")
                 return False
 
+    if not await scraper.metadata(scraper, multiverse_id, path):
+        logging.error(f"Failed to create caption for {path.name}")
+        path.unlink(missing_ok=True)
+        return False
 
-# Parse one page of cards
-async def get_cards_on_page(session: ClientSession, set_name: str, page: int):
-    url = f"{BASE_URL}/Pages/Search/Default.aspx?page={page}&set=[%22{urllib.parse.quote(set_name)}%22]"
-    try:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                try:
-                    soup = BeautifulSoup(await resp.text(), "lxml")
-                except FeatureNotFound:
-                    soup = BeautifulSoup(await resp.text(), "html.parser")
-                return soup.find_all("span", class_="cardTitle")
-    except Exception as e:
-        logging.error(f"Error getting cards from {url}: {e}")
-    return []
+    logging.info(f"Downloaded: {path.name}")
+    return True
 
 
-# Download all card images from one expansion
-async def download_set(session: ClientSession, set_name: str):
-    logging.info(f"Processing set: {set_name}")
-    set_folder = DATA_DIR / set_name.replace(" ", "_")
-    set_folder.mkdir(parents=True, exist_ok=True)
+async def save_metadata_sidecar(scraper: Scraper, multiverse_id: str, path: Path):
+    """Metadata stage: the card's Scryfall JSON through the scraper's own session."""
+    return await scraper.scryfall.save_metadata(multiverse_id, path)
 
-    seen_ids = set()
-    for page in range(5):  # Check up to 5 pages per set
-        card_spans = await get_cards_on_page(session, set_name, page)
-        if not card_spans:
-            break
 
-        tasks = []
-        for span in card_spans:
-            link = span.find("a")
-            if link:
-                href = link["href"]
-                multiverse_id = urllib.parse.parse_qs(urllib.parse.urlparse(href).query).get("multiverseid", [None])[0]
-                if multiverse_id and multiverse_id not in seen_ids:
-                    seen_ids.add(multiverse_id)
-                    img_path = set_folder / f"{multiverse_id}.jpg"
-                    if not img_path.exists():
-                        image_url = IMAGE_URL.format(multiverse_id)
-                        tasks.append(save_image(session, image_url, img_path, multiverse_id))
-        if tasks:
-            await asyncio.gather(*tasks)
-
-# Load sets from YAML config
+# Load sets from the YAML config, or the old one-set-per-line text file
 def load_sets():
     if CONFIG_PATH.exists():
         with open(CONFIG_PATH, 'r') as f:
             config = yaml.safe_load(f)
             return config.get("expansions", [])
+    if LEGACY_CONFIG_PATH.exists():
+        with open(LEGACY_CONFIG_PATH, 'r') as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith('//')]
     logging.error("No configuration file found.")
     return []
 
-# Main
-async def main():
+
+async def main(args):
     sets = load_sets()
-    # sets = sets[:5]  # Limit to first 5 sets for testing
+    if args.sets:
+        sets = args.sets
+    if args.limit:
+        sets = sets[:args.limit]
     if not sets:
         return
-    
-    sslcontext = ssl.create_default_context()
-    sslcontext.check_hostname = False
-    sslcontext.verify_mode = ssl.CERT_NONE
 
-    async with aiohttp.ClientSession(timeout=TIMEOUT, headers=HEADERS, connector=aiohttp.TCPConnector(ssl=sslcontext)) as session:
-        for set_name in sets:
-            await download_set(session, set_name)
+    bulk_index = BulkIndex(args.bulk_index) if args.bulk_index else None
+    start = time.perf_counter()
+    async with Scraper(args.concurrency, host_rates={"gatherer.wizards.com": args.rate},
+                       data_dir=args.out, bulk_index=bulk_index, metadata_batch=args.metadata_batch,
+                       metadata_interval=args.metadata_interval) as scraper:
+        reports = await scraper.scrape(sets, args.workers, args.discoverers)
+    elapsed = time.perf_counter() - start
+    downloaded = sum(r.downloaded for r in reports)
+    logging.info(f"Scraped {len(reports)} sets in {elapsed:.0f}s: {downloaded} downloaded "
+                 f"({downloaded / max(elapsed, 1e-9):.1f} images/s), {sum(r.failed for r in reports)} failed, "
+                 f"{sum(r.skipped for r in reports)} already present")
 
-    # async with aiohttp.ClientSession(timeout=TIMEOUT, headers=HEADERS) as session:
-    #     for set_name in sets:
-    #         await download_set(session, set_name)
 
 if __name__ == "__main__":
-    import asyncio
-
-    asyncio.run(main())
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('image_scraping.log'),
+            logging.StreamHandler()
+        ]
+    )
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help=f"requests in flight over every host (default: {CONCURRENCY})")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help=f"download tasks shared by every set (default: {WORKERS})")
+    parser.add_argument("--discoverers", type=int, default=DISCOVERERS,
+                        help=f"sets fetching their search pages at once (default: {DISCOVERERS})")
+    parser.add_argument("--rate", type=float, default=HOST_RATES["gatherer.wizards.com"],
+                        help="requests per second to Gatherer")
+    parser.add_argument("--out", type=Path, default=DATA_DIR, help=f"image tree (default: {DATA_DIR})")
+    parser.add_argument("--bulk-index", type=Path,
+                        help="scryfall_bulk.py index; metadata of the cards it holds is not requested")
+    parser.add_argument("--metadata-batch", type=int, default=COLLECTION_SIZE,
+                        help=f"cards per Scryfall collection request, 1 requests each card (default: {COLLECTION_SIZE})")
+    parser.add_argument("--metadata-interval", type=float, default=FLUSH_INTERVAL,
+                        help=f"seconds a card waits for its metadata batch to fill (default: {FLUSH_INTERVAL})")
+    parser.add_argument("--sets", nargs="+", help="these expansions instead of the config")
+    parser.add_argument("--limit", type=int, help="only the first N expansions of the config")
+    asyncio.run(main(parser.parse_args()))
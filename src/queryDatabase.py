@@ -1,53 +1,65 @@
 # coding=utf-8
 import os
-import sys
-import imagehash
-import numpy as np
 import psycopg2
-import math
+from hash_cascade import CascadeRanker
+from hash_search import HASH_TYPES, HashSearch, hamming_distance
+
+INDEX_PATH = "../data/hash_index.bin"
+RADIUS_INDEX_DIR = "../data/hash_index"
+# Below this many rows a linear popcount scan beats the radius index
+MIN_INDEXED_ROWS = 250000
+
+engine = None
+ranker = None
 
 
 def getValuesFromDb(con,cur):
-	global hashes, names
-	command = "select ahash,phash,psimplehash,phash,vertdhash,whash from binaryhashes"
-	cur.execute(command)          
-	hashes=cur.fetchall()
-	con.commit()
-    	command = "select name,set from binaryhashes"
-	cur.execute(command)          
-	names =cur.fetchall()
-	con.commit()
+    global engine
+    engine = HashSearch.from_db(cur)
+    con.commit()
+    useRadiusIndexes()
+
+def getValuesFromIndexFile(path=INDEX_PATH):
+    """Memory-map the index file written by buildBinaryDatabase; no database needed."""
+    global engine
+    engine = HashSearch.from_index_file(path)
+    useRadiusIndexes()
+
+def rankHashes(testHashes, k=10):
+    """
+    Print and return the best k cards over all six hashes of one query
+    (in getHash order), filtering with the cheapest hash first.
+    """
+    global ranker
+    if ranker is None or ranker.search is not engine:
+        ranker = CascadeRanker(engine)
+    matches = ranker.rank(testHashes, k)
+    for match in matches:
+        print(match)
+    return matches
+
+def useRadiusIndexes():
+    if len(engine) < MIN_INDEXED_ROWS:
+        return
+    os.makedirs(RADIUS_INDEX_DIR, exist_ok=True)
+    for hash_type in HASH_TYPES:
+        engine.build_radius_index(hash_type, os.path.join(RADIUS_INDEX_DIR, hash_type + ".npz"))
 
 def checkHashes(testHash,index,minDist):
-	global hashes, names
-        n=0
-        i=0
-        matches = [("","")]*200
-	for phash in hashes:
-            dbHash = str(phash[index])
-            hammingDist = hammingDistance(dbHash,testHash)
-	    if (math.fabs(hammingDist)<=minDist):
-                matches[i] = (math.fabs(hammingDist),names[n])
-                i+=1
-            n+=1
-        sortedMatches = sorted(matches,key= lambda hamming: hamming[0])
-        for x in range(0,i):
-            print sortedMatches[x]
+    """Print and return every card within minDist of testHash, nearest first."""
+    matches = engine.within(testHash, index, minDist)
+    for match in matches:
+        print(match)
+    return matches
 
 
 def hammingDistance(a,b):
-	count=0
-	a=str(a)
-	b=str(b)
-	if(len(a)!=len(b)):
-		print "Error: String lengths don't match"
-		sys.exit()
-		
-	for n in range (0,len(a)):
-		if(a[n]!=b[n]):
-			count+=1	
-	return count
-
-con = psycopg2.connect(database='cardimages', user='Devon')
-cur = con.cursor()
-getValuesFromDb(con,cur)
+    # str() keeps the old behaviour for hashes passed as ints of '0'/'1' digits
+    return hamming_distance(str(a).zfill(64), str(b).zfill(64))
+
+if os.path.exists(INDEX_PATH):
+    getValuesFromIndexFile()
+else:
+    con = psycopg2.connect(database='cardimages', user='Devon')
+    cur = con.cursor()
+    getValuesFromDb(con,cur)
@@ -1,9 +1,33 @@
 #from http://www.pyimagesearch.com/2014/04/21/building-pokedex-python-finding-game-boy-screen-step-4-6/
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import time
 import cv2
 import numpy as np
-from src import queryDatabase
 from PIL import Image
-import imagehash
+from art_crops import CARD_SIZE, HASH_ART_BOX, normalized_card
+from art_embedding import ambiguous, merge
+from fast_hash import multi_hash_hex
+from hash_cascade import CascadeRanker
+
+# Longest side of the image contours are detected on, then the pyramid tried
+# coarse to fine when nothing is found there
+DETECT_SIDE = 640
+PYRAMID_SIDES = (400, 960, 1280)
+# Largest contours examined per frame; a binder page has 9 cards, each with inner frames
+MAX_CONTOURS = 100
+# Quads smaller than this fraction of the largest card are art boxes, text boxes or noise
+MIN_CARD_AREA = .2
+# Longest side a card is warped at; hashing only needs CARD_SIZE
+MAX_WARP_SIDE = 2 * CARD_SIZE[1]
+
+DETECT_STAGES = ('resize', 'bilateral', 'canny', 'contours')
+
+CardResult = namedtuple("CardResult", ["contour", "hashes", "matches"])
+# contours are in the coordinates of image, img resized by scale; attempts
+# holds (scale, seconds, quads found) for every scale tried
+Detection = namedtuple("Detection", ["image", "contours", "scale", "attempts"])
 
 def hex_to_binary(hashString):
     return format(int(hashString,16),'0>64b')
@@ -13,45 +37,112 @@ def showImage(img):
     cv2.waitKey(0)
     cv2.destroyAllWindows()
 
+def artCrop(card):
+    """Grayscale art crop of an upright card (PIL image) at the database size."""
+    return normalized_card(card.convert('L')).crop(HASH_ART_BOX)
+
 def getHash(img):
-        size = 223,310
-        normal = Image.open(img).convert('L')
-        normal = normal.resize(size, Image.ANTIALIAS)
-        crop=normal.crop((25,37,195,150))
-        ahash = str(imagehash.average_hash(crop))
-        phash = str(imagehash.phash(crop))
-        psimplehash = str(imagehash.phash_simple(crop))
-        dhash = str(imagehash.dhash(crop))
-        vertdhash = str(imagehash.dhash_vertical(crop))
-        whash = str(imagehash.whash(crop))
-        return ahash,phash,psimplehash,phash,vertdhash,whash
+    # ahash,phash,psimplehash,dhash,vertdhash,whash from a single grayscale crop
+    return multi_hash_hex(artCrop(Image.open(img)))
 
-def findContours(img):
-    orig = img.copy()
-    img = cv2.resize(img,(0,0),fx=.25,fy=.25)
+def warpedArt(warped):
+    """Grayscale art crop of a warped BGR card array."""
+    return artCrop(Image.fromarray(cv2.cvtColor(warped, cv2.COLOR_BGR2RGB)))
+
+def hashCard(warped):
+    """getHash for a warped BGR card array, without writing it to disk."""
+    return multi_hash_hex(warpedArt(warped))
+
+def matchCard(warped, search, k=5, embeddings=None):
+    """
+    (hashes, ranked matches) of a warped card. With an art embedding index,
+    an ambiguous hash ranking is merged with the embedding matches.
+    """
+    art = warpedArt(warped)
+    hashes = multi_hash_hex(art)
+    # One ranker per card, its counters are not thread-safe
+    matches = CascadeRanker(search).rank(hashes, k)
+    if embeddings is not None and ambiguous(matches):
+        matches = merge(matches, embeddings.search(np.asarray(art), k), k)
+    return hashes, matches
+
+def insideAny(contour, kept):
+    """True when the centre of contour lies in one of the kept contours."""
+    m = cv2.moments(contour)
+    if m['m00'] == 0:
+        return True
+    centre = (m['m10'] / m['m00'], m['m01'] / m['m00'])
+    return any(cv2.pointPolygonTest(k, centre, False) >= 0 for k in kept)
+
+def detectionScale(shape, side=DETECT_SIDE):
+    """Scale bringing the longest side of an image of this shape down to side."""
+    return min(1., side / max(shape[:2]))
+
+def findQuads(img, scale, debug=None):
+    """
+    Resize img by scale and find every card-sized 4-point contour, largest
+    first. Contours nested in a larger one (the inner and outer edge of the
+    same border, the art box) are dropped. With debug, the edge map and the
+    seconds spent in each step are stored in it.
+    """
+    times = [time.perf_counter()]
+    if scale != 1:
+        img = cv2.resize(img,(0,0),fx=scale,fy=scale)
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    times.append(time.perf_counter())
     gray = cv2.bilateralFilter(gray, 11, 17, 17)
+    times.append(time.perf_counter())
     edged = cv2.Canny(gray, 30, 200)
-    im2,cnts,heir = cv2.findContours(edged.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-    cnts = sorted(cnts, key = cv2.contourArea, reverse = True)[:10]
-    screenCnt = None
-    i=0
-    screenCnt ={}
+    times.append(time.perf_counter())
+    # OpenCV 3 returns (image, contours, hierarchy), OpenCV 4 (contours, hierarchy)
+    cnts = cv2.findContours(edged.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    cnts = sorted(cnts, key = cv2.contourArea, reverse = True)[:MAX_CONTOURS]
+    screenCnt = []
     # loop over our contours
     for c in cnts:
-    	# approximate the contour
-    	peri = cv2.arcLength(c, True)
-    	approx = cv2.approxPolyDP(c, .02 * peri, True)
-        if len(approx) == 4:
-                screenCnt[i] = approx
-                i+=1
-
-    crop(img,0,screenCnt)
-    '''
-    for box in screenCnt:
-        ratio = 1 /(cv2.contourArea(screenCnt[0])/cv2.contourArea(screenCnt[box]))
-        crop(img,box,screenCnt)
-    '''
+        # approximate the contour
+        peri = cv2.arcLength(c, True)
+        approx = cv2.approxPolyDP(c, .02 * peri, True)
+        if len(approx) != 4 or not cv2.isContourConvex(approx):
+            continue
+        if screenCnt and cv2.contourArea(approx) < MIN_CARD_AREA * cv2.contourArea(screenCnt[0]):
+            continue
+        if not insideAny(approx, screenCnt):
+            screenCnt.append(approx)
+    times.append(time.perf_counter())
+    if debug is not None:
+        debug['edged'] = edged
+        seconds = debug.setdefault('seconds', {})
+        for stage, start, end in zip(DETECT_STAGES, times, times[1:]):
+            seconds[stage] = seconds.get(stage, 0.) + end - start
+    return img, screenCnt
+
+def detectCards(img, debug=None, scale=None):
+    """
+    Find the cards in img at a working resolution picked from its size
+    (DETECT_SIDE pixels on the longest side), falling back to the
+    PYRAMID_SIDES resolutions, coarse to fine, when no card is found. A fixed
+    scale skips the policy and the fallback. Returns a Detection.
+    """
+    if scale:
+        scales = [scale]
+    else:
+        scales = [detectionScale(img.shape)]
+        for side in PYRAMID_SIDES:
+            if detectionScale(img.shape, side) not in scales:
+                scales.append(detectionScale(img.shape, side))
+    attempts = []
+    for scale in scales:
+        start = time.perf_counter()
+        small, screenCnt = findQuads(img, scale, debug)
+        attempts.append((scale, time.perf_counter() - start, len(screenCnt)))
+        if screenCnt:
+            break
+    return Detection(small, screenCnt, scale, attempts)
+
+def findContours(img):
+    detection = detectCards(img)
+    crop(img,0,detection.contours,detection.scale)
 
 # from https://www.pyimagesearch.com/2014/08/25/4-point-opencv-getperspective-transform-example/
 def order_points(pts):
@@ -116,16 +207,79 @@ def four_point_transform(image, pts):
     # return the warped image
     return warped
 
-def crop(img,art, screenCnt):
-    mask = np.zeros_like(img)
-    cv2.drawContours(mask, [screenCnt[art]], -1, (255,255,255), -1)
-    out = np.zeros_like(img)
-    out[mask == 255] = img[mask == 255]
-    rect = cv2.minAreaRect(screenCnt[art])
-    box = cv2.boxPoints(rect)
-    box = np.int0(box)
-    rotatedCropped = four_point_transform(out,box)
-    cv2.imwrite('crop.jpg',rotatedCropped)
+def warpCard(img, contour, scale=1.):
+    """
+    Top-down view of the card inside contour. The contour is in the coordinates
+    of img resized by scale, as detectCards returns it, so detection can run on
+    the downscaled frame and the warp on the full resolution one. Only the
+    bounding region of the card is read, shrunk so the card is at most
+    MAX_WARP_SIDE pixels long, so time and memory stay the same per card
+    whatever the photo size.
+    """
+    rect = cv2.minAreaRect(contour)
+    box = cv2.boxPoints(rect) / scale
+    contour = contour.reshape(-1, 2) / scale
+    x, y, w, h = cv2.boundingRect(np.vstack([box, contour]).astype(np.float32))
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, img.shape[1]), min(y + h, img.shape[0])
+    roi = img[y0:y1, x0:x1]
+    box, contour = box - (x0, y0), contour - (x0, y0)
+    shrink = MAX_WARP_SIDE * scale / max(max(rect[1]), 1)
+    if shrink < 1:
+        roi = cv2.resize(roi, (0,0), fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA)
+        box, contour = box * shrink, contour * shrink
+    mask = np.zeros(roi.shape[:2], dtype=np.uint8)
+    cv2.fillPoly(mask, [np.round(contour).astype(np.int32)], 255)
+    return four_point_transform(cv2.bitwise_and(roi, roi, mask=mask), box)
+
+def crop(img,art, screenCnt, scale=1.):
+    cv2.imwrite('crop.jpg',warpCard(img, screenCnt[art], scale))
+
+def frameContour(contour, scale):
+    """Contour found by detectCards in frame (full resolution) coordinates."""
+    return np.round(contour / scale).astype(np.int32)
+
+def identifyFrame(img, search, k=5, debugDir=None, embeddings=None):
+    """
+    Camera frame -> warped card -> grayscale art crop -> hashes -> ranked
+    matches, entirely in memory. Returns a CardResult for the largest card, or
+    None when no card outline is found. With debugDir, the edge map, detected
+    outline, warped card and art crop are written there. embeddings is an
+    optional art_embedding.EmbeddingIndex for ambiguous hash results.
+    """
+    debug = {} if debugDir else None
+    small, screenCnt, scale, _ = detectCards(img, debug)
+    if not screenCnt:
+        return None
+    warped = warpCard(img, screenCnt[0], scale)
+    hashes, matches = matchCard(warped, search, k, embeddings)
+    if debugDir:
+        os.makedirs(debugDir, exist_ok=True)
+        outline = small.copy()
+        cv2.drawContours(outline, [screenCnt[0]], -1, (0,255,0), 2)
+        cv2.imwrite(os.path.join(debugDir, 'edged.png'), debug['edged'])
+        cv2.imwrite(os.path.join(debugDir, 'outline.png'), outline)
+        cv2.imwrite(os.path.join(debugDir, 'warped.png'), warped)
+        warpedArt(warped).save(os.path.join(debugDir, 'art.png'))
+    return CardResult(frameContour(screenCnt[0], scale), hashes, matches)
+
+def identifyCards(img, search, k=5, workers=None, embeddings=None):
+    """
+    Identify every card in one photo (a playmat, a binder page): one detection
+    pass, then each card is warped, hashed and ranked on a thread pool (OpenCV,
+    PIL and numpy release the GIL). Returns a CardResult per card, largest
+    first, with the contour in frame coordinates.
+    """
+    _, screenCnt, scale, _ = detectCards(img)
+
+    def identify(contour):
+        hashes, matches = matchCard(warpCard(img, contour, scale), search, k, embeddings)
+        return CardResult(frameContour(contour, scale), hashes, matches)
+
+    if len(screenCnt) <= 1 or workers == 1:
+        return [identify(contour) for contour in screenCnt]
+    with ThreadPoolExecutor(workers or min(len(screenCnt), os.cpu_count() or 1)) as pool:
+        return list(pool.map(identify, screenCnt))
 
 def crop2(img,art, screenCnt):
     mask = np.zeros_like(img)
@@ -134,7 +288,7 @@ def crop2(img,art, screenCnt):
     out[mask == 255] = img[mask == 255]
     rect = cv2.minAreaRect(screenCnt[art])
     box = cv2.boxPoints(rect)
-    box = np.int0(box)
+    box = np.intp(box)
 
     W = rect[1][0]
     H = rect[1][1]
@@ -164,13 +318,22 @@ def crop2(img,art, screenCnt):
     # Final cropped & rotated rectangle
     croppedRotated = cv2.getRectSubPix(cropped, (int(croppedW),int(croppedH)), (size[0]/2, size[1]/2))
 
-for j in range(1,7):
-    print "IMAGE #: "+str(j)
-    img = cv2.imread('cameraImages/'+str(j)+'.JPG')
-    findContours(img)
-    for i in range(0,1):
-        if(i != 2):
-            print "----------------------------------"+str(i)+"--------------------------------------"
-            binHash = hex_to_binary(getHash('crop.jpg')[i])
-            print binHash
-            queryDatabase.checkHashes(binHash, i, 13)
+if __name__ == "__main__":
+    import queryDatabase
+
+    # Hash every photo in memory first, then identify them all with one batch query
+    photos, binHashes = [], []
+    for j in range(1,7):
+        img = cv2.imread('cameraImages/'+str(j)+'.JPG')
+        detection = detectCards(img)
+        if not detection.contours:
+            print("IMAGE #: "+str(j)+" - no card found")
+            continue
+        photos.append(j)
+        binHashes.append(hex_to_binary(hashCard(warpCard(img, detection.contours[0], detection.scale))[0]))
+    results = queryDatabase.engine.top_k_batch(binHashes, 0, k=5) if binHashes else []
+    for j, binHash, matches in zip(photos, binHashes, results):
+        print("IMAGE #: "+str(j))
+        print(binHash)
+        for match in matches:
+            print(match)
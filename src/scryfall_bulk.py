@@ -0,0 +1,151 @@
+# coding=utf-8
+"""
+Local Scryfall card lookups from a bulk-data file.
+
+Scryfall publishes every card as one large JSON array (bulk data). This module
+downloads it once, stream-parses it with bounded memory (one read chunk plus
+the card being decoded) and writes an on-disk SQLite index of the card objects
+keyed by multiverse id. Metadata sidecars then come from a primary key lookup
+instead of one HTTPS request per card:
+
+    python scryfall_bulk.py --download
+    python scryfall_bulk.py --bulk ../data/scryfall/default-cards.json --out ../data/scryfall_bulk.sqlite
+
+write_captions.save_metadata and write_captions.ScryfallClient take the
+resulting BulkIndex and only go to the API for cards it doesn't hold.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+
+BULK_DATA_URL = "https://api.scryfall.com/bulk-data/{}"
+BULK_TYPE = "default_cards"
+BULK_PATH = '../data/scryfall/default-cards.json'
+INDEX_PATH = '../data/scryfall_bulk.sqlite'
+CHUNK_SIZE = 1 << 20
+
+SCHEMA = "create table cards (multiverse_id integer primary key, data blob not null)"
+
+
+def download_bulk(out, bulk_type=BULK_TYPE, chunk_size=CHUNK_SIZE):
+    """Stream the current bulk file of bulk_type (default_cards, all_cards, ...) to out."""
+    response = requests.get(BULK_DATA_URL.format(bulk_type.replace("_", "-")), timeout=30)
+    response.raise_for_status()
+    uri = response.json()["download_uri"]
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    tmp_path = out + ".tmp"
+    with requests.get(uri, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+    os.replace(tmp_path, out)
+    return out
+
+
+def iter_cards(path, chunk_size=CHUNK_SIZE):
+    """
+    Yield the objects of a JSON array file (optionally .gz) one at a time,
+    reading chunk_size characters at a time and decoding with raw_decode.
+    A file that ends before its closing bracket raises json.JSONDecodeError.
+    """
+    decoder = json.JSONDecoder()
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        buffer, pos, eof, closed = "", 0, False, False
+        while True:
+            # Array brackets, commas and whitespace between the objects
+            while pos < len(buffer) and buffer[pos] in "[], \t\r\n":
+                closed = closed or buffer[pos] == "]"
+                pos += 1
+            if pos < len(buffer):
+                try:
+                    card, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # The object continues in the next chunk
+                    if eof:
+                        raise
+                else:
+                    pos = end
+                    yield card
+                    continue
+            elif eof:
+                if not closed:
+                    raise json.JSONDecodeError("Unterminated array", buffer, pos)
+                return
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+
+
+def build_index(bulk_path, out, batch_size=1000) -> int:
+    """Index every card of a bulk file under each of its multiverse ids; returns the row count."""
+    tmp_path = out + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = sqlite3.connect(tmp_path)
+    con.execute(SCHEMA)
+    rows, count = [], 0
+    for card in iter_cards(bulk_path):
+        ids = card.get("multiverse_ids") or []
+        if not ids:
+            continue
+        data = zlib.compress(json.dumps(card, separators=(",", ":")).encode("utf-8"))
+        rows.extend((multiverse_id, data) for multiverse_id in ids)
+        if len(rows) >= batch_size:
+            con.executemany("insert or replace into cards values (?, ?)", rows)
+            count += len(rows)
+            rows = []
+    con.executemany("insert or replace into cards values (?, ?)", rows)
+    count += len(rows)
+    con.commit()
+    con.close()
+    os.replace(tmp_path, out)
+    return count
+
+
+class BulkIndex:
+    """Read-only card lookups in an index written by build_index; safe to share between threads."""
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.con = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return self.con.execute("select count(*) from cards").fetchone()[0]
+
+    def card(self, multiverse_id):
+        """Scryfall card object of one multiverse id, or None."""
+        with self.lock:
+            row = self.con.execute("select data from cards where multiverse_id = ?",
+                                   (int(multiverse_id),)).fetchone()
+        return None if row is None else json.loads(zlib.decompress(row[0]))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build the local Scryfall multiverse id index from a bulk-data file")
+    parser.add_argument("--bulk", default=BULK_PATH, help=f"bulk-data JSON file, or .json.gz (default: {BULK_PATH})")
+    parser.add_argument("--download", action="store_true", help="download the current bulk file to --bulk first")
+    parser.add_argument("--type", default=BULK_TYPE, help=f"bulk-data type to download (default: {BULK_TYPE})")
+    parser.add_argument("--out", default=INDEX_PATH, help=f"SQLite index (default: {INDEX_PATH})")
+    args = parser.parse_args()
+
+    if args.download:
+        start = time.perf_counter()
+        download_bulk(args.bulk, args.type)
+        logging.info(f"Downloaded {args.type} to {args.bulk} in {time.perf_counter() - start:.0f}s")
+    start = time.perf_counter()
+    count = build_index(args.bulk, args.out)
+    logging.info(f"Indexed {count} multiverse ids in {args.out} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,242 @@
+# coding=utf-8
+"""
+Real-time card identification on a video file or capture device.
+
+Full detection (bilateral filter, Canny, findContours) only runs when there is
+nothing to track, when a track is lost, or every --redetect frames to pick up
+new cards. In between, the card corners are followed with pyramidal
+Lucas-Kanade optical flow on a downscaled grayscale frame, and a card is only
+warped at full resolution, re-hashed and re-ranked when a thumbnail warped
+from that downscaled frame has changed.
+
+    python src/video_identify.py --source 0 --display
+    python src/video_identify.py --source clip.mp4 --index data/hash_index.bin
+
+Sustained FPS and the mean time of every stage are logged every few seconds
+and once more at the end.
+"""
+import argparse
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from hash_cascade import CascadeRanker
+from hash_search import HashSearch
+from rotateCrop import detectCards, hashCard, order_points, warpCard
+
+INDEX_PATH = "data/hash_index.bin"
+REDETECT_EVERY = 30
+# Mean absolute difference (0-255) of the crop thumbnail that triggers re-identification
+CHANGE_THRESHOLD = 12.0
+THUMBNAIL_SIZE = (16, 22)
+# The thumbnail is warped at this multiple of THUMBNAIL_SIZE, then area-averaged
+# down, so sub-pixel tracking jitter doesn't alias into a "change"
+THUMBNAIL_OVERSAMPLE = 4
+# A track is lost when its area changes by more than this factor between frames
+MAX_AREA_CHANGE = 1.5
+FLOW_PARAMS = dict(winSize=(21, 21), maxLevel=3,
+                   criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+REPORT_EVERY = 5.0
+
+
+class StageTimer:
+    """Accumulated wall time and call count per pipeline stage."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    @contextmanager
+    def __call__(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - start
+            self.calls[stage] += 1
+
+    def report(self) -> str:
+        return ", ".join(f"{stage} {1e3 * self.seconds[stage] / self.calls[stage]:.1f}ms x{self.calls[stage]}"
+                         for stage in self.seconds)
+
+
+class Track:
+    """One card followed across frames, corners in the frame resized by scale."""
+
+    def __init__(self, corners, scale):
+        self.corners = corners.reshape(4, 1, 2).astype(np.float32)
+        self.scale = scale
+        self.thumbnail = None
+        self.hashes = None
+        self.matches = []
+
+    @property
+    def area(self) -> float:
+        return cv2.contourArea(self.corners)
+
+    def frame_corners(self):
+        return self.corners.reshape(4, 2) / self.scale
+
+
+class VideoIdentifier:
+    """Detect, track and identify cards frame by frame."""
+
+    def __init__(self, search, k=5, redetect_every=REDETECT_EVERY, change_threshold=CHANGE_THRESHOLD):
+        self.ranker = CascadeRanker(search)
+        self.k = k
+        self.redetect_every = redetect_every
+        self.change_threshold = change_threshold
+        self.timer = StageTimer()
+        self.tracks = []
+        self.previous = None
+        self.scale = None
+        self.frames = 0
+        self.since_detect = 0
+        self.identifications = 0
+
+    def detect(self, frame):
+        with self.timer("detect"):
+            small, screenCnt, self.scale, _ = detectCards(frame)
+        self.tracks = [Track(contour, self.scale) for contour in screenCnt]
+        self.since_detect = 0
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def track(self, gray) -> bool:
+        """Move every track with optical flow; False when any of them is lost."""
+        with self.timer("track"):
+            points = np.concatenate([t.corners for t in self.tracks])
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(self.previous, gray, points, None, **FLOW_PARAMS)
+            if moved is None or not status.all():
+                return False
+            for i, t in enumerate(self.tracks):
+                corners = moved[4 * i:4 * i + 4]
+                area = cv2.contourArea(corners)
+                if not cv2.isContourConvex(corners.astype(np.int32)) or \
+                        not t.area / MAX_AREA_CHANGE < area < t.area * MAX_AREA_CHANGE:
+                    return False
+                t.corners = corners
+        return True
+
+    @staticmethod
+    def thumbnail(gray, t: Track):
+        """Small grayscale top-down view of t, warped from the downscaled frame the track lives in."""
+        w, h = THUMBNAIL_SIZE[0] * THUMBNAIL_OVERSAMPLE, THUMBNAIL_SIZE[1] * THUMBNAIL_OVERSAMPLE
+        target = np.float32([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]])
+        M = cv2.getPerspectiveTransform(order_points(t.corners.reshape(4, 2)), target)
+        warped = cv2.warpPerspective(gray, M, (w, h))
+        return cv2.resize(warped, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def identify(self, frame, gray, t: Track):
+        """Re-hash and re-rank t only when its thumbnail changed since the last identification."""
+        with self.timer("thumbnail"):
+            thumbnail = self.thumbnail(gray, t)
+        if t.thumbnail is not None and np.abs(thumbnail - t.thumbnail).mean() < self.change_threshold:
+            return
+        with self.timer("warp"):
+            warped = warpCard(frame, t.corners, t.scale)
+            if warped.size == 0:
+                return
+        with self.timer("hash"):
+            t.hashes = hashCard(warped)
+        with self.timer("rank"):
+            t.matches = self.ranker.rank(t.hashes, self.k)
+        t.thumbnail = thumbnail
+        self.identifications += 1
+
+    def process(self, frame):
+        """Update the tracks with one BGR frame and return them."""
+        self.frames += 1
+        self.since_detect += 1
+        gray = None
+        if self.tracks and self.previous is not None and self.since_detect < self.redetect_every:
+            with self.timer("downscale"):
+                small = cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale)
+                gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            if not self.track(gray):
+                gray = None
+        if gray is None:
+            old_tracks = self.tracks
+            gray = self.detect(frame)
+            self._inherit(old_tracks)
+        self.previous = gray
+        for t in self.tracks:
+            self.identify(frame, gray, t)
+        return self.tracks
+
+    def _inherit(self, old_tracks):
+        """Keep the identification of a re-detected card that overlaps an old track."""
+        for t in self.tracks:
+            centre = tuple(float(c) for c in t.corners.reshape(4, 2).mean(axis=0))
+            for old in old_tracks:
+                if old.thumbnail is not None and cv2.pointPolygonTest(old.corners, centre, False) >= 0:
+                    t.thumbnail, t.hashes, t.matches = old.thumbnail, old.hashes, old.matches
+                    break
+
+
+def draw(frame, tracks):
+    for t in tracks:
+        corners = t.frame_corners().astype(np.int32)
+        cv2.polylines(frame, [corners], True, (0, 255, 0), 2)
+        if t.matches:
+            label = f"{t.matches[0].name} ({t.matches[0].confidence:.2f})"
+            x, y = corners.min(axis=0)
+            cv2.putText(frame, label, (int(x), max(int(y) - 8, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+    return frame
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="0", help="video file, or capture device number (default: 0)")
+    parser.add_argument("--index", default=INDEX_PATH, help=f"hash index file (default: {INDEX_PATH})")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--redetect", type=int, default=REDETECT_EVERY, help="full detection every N frames")
+    parser.add_argument("--change-threshold", type=float, default=CHANGE_THRESHOLD)
+    parser.add_argument("--display", action="store_true", help="show the annotated frames (q quits)")
+    args = parser.parse_args()
+
+    capture = cv2.VideoCapture(int(args.source) if args.source.isdigit() else args.source)
+    if not capture.isOpened():
+        parser.error(f"Could not open {args.source}")
+    identifier = VideoIdentifier(HashSearch.from_index_file(args.index), args.k, args.redetect, args.change_threshold)
+
+    start = last_report = time.perf_counter()
+    reported = {}
+    try:
+        while True:
+            with identifier.timer("capture"):
+                ok, frame = capture.read()
+            if not ok:
+                break
+            tracks = identifier.process(frame)
+            for i, t in enumerate(tracks):
+                if t.matches and reported.get(i) != t.matches[0].name:
+                    reported[i] = t.matches[0].name
+                    logging.info(f"Card {i}: {t.matches[0].name} ({t.matches[0].set}), confidence {t.matches[0].confidence:.2f}")
+            if args.display:
+                cv2.imshow("cards", draw(frame, tracks))
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+            now = time.perf_counter()
+            if now - last_report >= REPORT_EVERY:
+                logging.info(f"{identifier.frames / (now - start):.1f} FPS - {identifier.timer.report()}")
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.release()
+        if args.display:
+            cv2.destroyAllWindows()
+
+    elapsed = time.perf_counter() - start
+    logging.info(f"{identifier.frames} frames in {elapsed:.1f}s, {identifier.frames / max(elapsed, 1e-9):.1f} FPS, "
+                 f"{identifier.identifications} identifications")
+    logging.info(identifier.timer.report())
+
+
+if __name__ == "__main__":
+    main()
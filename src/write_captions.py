@@ -1,9 +1,16 @@
+import asyncio
 import requests
 import os
 import json
 import logging
 import unicodedata
 
+SCRYFALL_URL = "https://api.scryfall.com"
+# /cards/collection takes at most 75 identifiers per request
+COLLECTION_SIZE = 75
+# Seconds a pending multiverse id waits for its batch to fill
+FLUSH_INTERVAL = 0.5
+
 def clean_unicode(text: str) -> str:
     # Normalize Unicode to NFKD form and encode to ASCII
     return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
@@ -30,9 +37,41 @@ def cut_caption(content):
 
 
 
-def save_metadata(multiverse_id, image_path):
+def write_sidecar(data, image_path):
+    """Save a card's Scryfall JSON next to its image."""
+    json_path = os.path.splitext(image_path)[0] + ".json"
+    with open(json_path, "w", encoding="utf-8") as json_file:
+        json.dump(data, json_file, indent=4)
+
+
+def scryfall_error(multiverse_id, data):
+    """True (and logged) when a Scryfall response is an error object."""
+    if 'error' in data or data.get('object') == 'error':
+        error_code = data.get('code', 'unknown')
+        error_details = data.get('details', 'No details provided')
+        logging.error(f"Error fetching data for {multiverse_id}: {error_code} - {error_details}")
+        return True
+    return False
+
+
+def save_local_metadata(bulk_index, multiverse_id, image_path):
+    """Write the sidecar from a scryfall_bulk.BulkIndex; False when the card isn't in it."""
+    data = bulk_index.card(multiverse_id)
+    if data is None:
+        return False
+    write_sidecar(data, image_path)
+    return True
+
+
+def save_metadata(multiverse_id, image_path, bulk_index=None):
+    """
+    Write the Scryfall JSON of a card next to its image. With a
+    scryfall_bulk.BulkIndex the card is looked up locally first.
+    """
     try:
-        api_url = f"https://api.scryfall.com/cards/multiverse/{multiverse_id}?language=en"
+        if bulk_index is not None and save_local_metadata(bulk_index, multiverse_id, image_path):
+            return True
+        api_url = f"{SCRYFALL_URL}/cards/multiverse/{multiverse_id}?language=en"
         response = requests.get(api_url)
         
         # Check HTTP status code first
@@ -43,16 +82,11 @@ def save_metadata(multiverse_id, image_path):
         data = response.json()
         
         # Check if the response contains an error
-        if 'error' in data:
-            error_code = data.get('code', 'unknown')
-            error_details = data.get('details', 'No details provided')
-            logging.error(f"Error fetching data for {multiverse_id}: {error_code} - {error_details}")
+        if scryfall_error(multiverse_id, data):
             return False
         
         # save the json data to a file
-        json_path = os.path.splitext(image_path)[0] + ".json"
-        with open(json_path, "w", encoding="utf-8") as json_file:
-            json.dump(data, json_file, indent=4)
+        write_sidecar(data, image_path)
 
         # Generate the caption using the combined methodology, removed from the scraper, doing it later
         # caption = generate_caption(data)
@@ -74,6 +108,105 @@ def save_metadata(multiverse_id, image_path):
     except Exception as e:
         logging.error(f"Error creating caption file for {multiverse_id}: {e}")
         return False
+
+
+class ScryfallClient:
+    """
+    Non-blocking save_metadata for the async scraper.
+
+    Every request goes through request(method, url, kind, **kwargs), normally
+    image_scraper.Scraper.request: the scraper's session and connection pool,
+    its concurrency limit and the api.scryfall.com rate limit (Scryfall asks
+    for 50-100 ms between requests). Sidecars are written on a worker thread.
+    With a scryfall_bulk.BulkIndex, only cards missing from it are requested.
+
+    Concurrent card() calls are batched: pending multiverse ids are resolved
+    by one POST /cards/collection once flush_size of them are waiting, or
+    flush_interval seconds after the first one, and every result is handed
+    back to its caller. flush_size=1 requests each card on its own.
+    """
+
+    def __init__(self, request, base_url=None, bulk_index=None, flush_size=COLLECTION_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        self.request = request
+        self.base_url = base_url or SCRYFALL_URL
+        self.bulk_index = bulk_index
+        self.flush_size = max(1, min(flush_size, COLLECTION_SIZE))
+        self.flush_interval = flush_interval
+        # multiverse id -> futures of the callers waiting for it
+        self.pending = {}
+        self.timer = None
+        self.flushes = set()
+
+    async def card(self, multiverse_id):
+        """Scryfall card object of one multiverse id, or None."""
+        if self.flush_size == 1:
+            return await self.single_card(multiverse_id)
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(int(multiverse_id), []).append(future)
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+        return await future
+
+    async def single_card(self, multiverse_id):
+        data = await self.request("GET", f"{self.base_url}/cards/multiverse/{multiverse_id}?language=en", "json",
+                                  headers={"Accept": "application/json"})
+        if data is None or scryfall_error(multiverse_id, data):
+            return None
+        return data
+
+    def flush(self):
+        """Send the pending ids, flush_size per collection request."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.pending:
+            batch = dict(list(self.pending.items())[:self.flush_size])
+            for multiverse_id in batch:
+                del self.pending[multiverse_id]
+            task = asyncio.ensure_future(self.resolve(batch))
+            # Keep a reference until it is done
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+
+    async def resolve(self, batch):
+        """One /cards/collection request for batch (id -> futures); sets every future."""
+        cards = {}
+        try:
+            data = await self.request("POST", f"{self.base_url}/cards/collection", "json",
+                                      json={"identifiers": [{"multiverse_id": i} for i in batch]},
+                                      headers={"Accept": "application/json"})
+            if data is not None and not scryfall_error(list(batch), data):
+                for card in data.get("data", []):
+                    for multiverse_id in card.get("multiverse_ids", []):
+                        cards[multiverse_id] = card
+                if data.get("not_found"):
+                    logging.warning(f"Cards not found: {data['not_found']}")
+        finally:
+            for multiverse_id, futures in batch.items():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(cards.get(multiverse_id))
+
+    async def save_metadata(self, multiverse_id, image_path):
+        if self.bulk_index is not None:
+            try:
+                if await asyncio.to_thread(save_local_metadata, self.bulk_index, multiverse_id, str(image_path)):
+                    return True
+            except OSError as e:
+                logging.error(f"Error creating caption file for {multiverse_id}: {e}")
+                return False
+        data = await self.card(multiverse_id)
+        if data is None:
+            return False
+        try:
+            await asyncio.to_thread(write_sidecar, data, str(image_path))
+        except OSError as e:
+            logging.error(f"Error creating caption file for {multiverse_id}: {e}")
+            return False
+        return True
     
 
 def generate_caption_from_metadata(card_data):
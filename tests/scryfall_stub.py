@@ -0,0 +1,78 @@
+# coding=utf-8
+"""
+Local stand-in for the Scryfall endpoints the scraper uses, on a free port:
+
+    async with ScryfallStub({123: {...}}) as stub:
+        ... stub.url, stub.requests
+
+Cards are served by GET /cards/multiverse/<id> and POST /cards/collection;
+unknown ids get Scryfall's 404 error object and the collection's not_found.
+Every request is recorded as (loop time, method, path, multiverse ids).
+"""
+import asyncio
+
+from aiohttp import web
+
+
+def card(multiverse_id, name=None, set_name="Stub Set", **fields):
+    """A minimal Scryfall card object."""
+    return dict({"object": "card", "name": name or f"Card {multiverse_id}", "set_name": set_name,
+                 "multiverse_ids": [multiverse_id]}, **fields)
+
+
+def not_found(details):
+    return web.json_response({"object": "error", "code": "not_found", "status": 404, "details": details},
+                             status=404)
+
+
+class ScryfallStub:
+    def __init__(self, cards, delay=0.0):
+        # multiverse id -> card, every id of a card maps to the same object
+        self.cards = {}
+        for data in cards:
+            for multiverse_id in data["multiverse_ids"]:
+                self.cards[multiverse_id] = data
+        self.delay = delay
+        self.requests = []
+        self.runner = None
+        self.url = None
+
+    def record(self, request, ids):
+        self.requests.append((asyncio.get_running_loop().time(), request.method, request.path, ids))
+
+    async def multiverse(self, request):
+        multiverse_id = int(request.match_info["id"])
+        self.record(request, [multiverse_id])
+        await asyncio.sleep(self.delay)
+        if multiverse_id not in self.cards:
+            return not_found(f"No card found with the given multiverse ID '{multiverse_id}'")
+        return web.json_response(self.cards[multiverse_id])
+
+    async def collection(self, request):
+        ids = [identifier["multiverse_id"] for identifier in (await request.json())["identifiers"]]
+        self.record(request, ids)
+        await asyncio.sleep(self.delay)
+        if len(ids) > 75:
+            return web.json_response({"object": "error", "code": "bad_request", "status": 400,
+                                      "details": "Too many identifiers"}, status=400)
+        data, missing = [], []
+        for multiverse_id in ids:
+            if multiverse_id not in self.cards:
+                missing.append({"multiverse_id": multiverse_id})
+            elif self.cards[multiverse_id] not in data:
+                data.append(self.cards[multiverse_id])
+        return web.json_response({"object": "list", "not_found": missing, "data": data})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/cards/multiverse/{id}", self.multiverse)
+        app.router.add_post("/cards/collection", self.collection)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = "http://127.0.0.1:{}".format(self.runner.addresses[0][1])
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
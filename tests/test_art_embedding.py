@@ -0,0 +1,43 @@
+# coding=utf-8
+from art_embedding import EmbeddingMatch, ambiguous, merge
+from hash_cascade import CascadeMatch
+
+LEA = "Limited Edition Alpha"
+
+
+def cascade(confidence, name, card_id=None):
+    return CascadeMatch(confidence, 32 * (1 - confidence), name, LEA, card_id, {})
+
+
+def embedding(confidence, name, card_id=None):
+    return EmbeddingMatch(confidence, 2 * (1 - confidence), name, LEA, card_id)
+
+
+def test_ambiguous():
+    assert ambiguous([])
+    assert ambiguous([cascade(0.4, "Forest")])
+    assert not ambiguous([cascade(0.9, "Forest"), cascade(0.5, "Island")])
+    # Another printing of the best card is no competition
+    assert not ambiguous([cascade(0.9, "Forest", 1), cascade(0.9, "Forest", 2), cascade(0.5, "Island")])
+    assert ambiguous([cascade(0.9, "Forest"), cascade(0.89, "Island")])
+
+
+def test_merge_ranks_by_mean_confidence():
+    hashes = [cascade(0.8, "Forest"), cascade(0.78, "Island"), cascade(0.7, "Swamp")]
+    embeddings = [embedding(0.9, "Island"), embedding(0.6, "Forest"), embedding(0.5, "Mountain")]
+    merged = merge(hashes, embeddings, k=10)
+    assert [m.name for m in merged] == ["Island", "Forest", "Swamp", "Mountain"]
+    # Each card keeps the fields of the matcher that found it first
+    assert isinstance(merged[0], CascadeMatch) and isinstance(merged[3], EmbeddingMatch)
+    assert merged[0].confidence == (0.78 + 0.9) / 2
+    # Swamp takes the lowest embedding confidence, Mountain the lowest cascade one
+    assert merged[2].confidence == (0.7 + 0.5) / 2
+    assert merged[3].confidence == (0.7 + 0.5) / 2
+    assert [m.name for m in merge(hashes, embeddings, k=2)] == ["Island", "Forest"]
+
+
+def test_merge_keeps_printings_apart_and_handles_empty_lists():
+    merged = merge([cascade(0.8, "Forest", 1)], [embedding(0.8, "Forest", 2)])
+    assert [m.card_id for m in merged] == [1, 2]
+    assert [m.confidence for m in merge([], [embedding(0.8, "Forest")])] == [0.4]
+    assert merge([], []) == []
@@ -0,0 +1,37 @@
+# coding=utf-8
+import json
+import sqlite3
+
+from buildBinaryDatabase import writeIndexFile
+from card_metadata import build_metadata
+from hash_loader import HashLoader
+from hash_search import HASH_TYPES, HashSearch
+from test_hash_search import SCHEMA
+
+LEA = "Limited Edition Alpha"
+
+
+def test_index_rows_carry_the_multiverse_id_of_their_image(tmp_path):
+    images = tmp_path / "images" / "lea"
+    images.mkdir(parents=True)
+    for key, name in ((100, "Forest"), (101, "Forest"), (102, "Island")):
+        (images / f"{key}.json").write_text(json.dumps({"name": name, "set_name": LEA}), encoding="utf-8")
+    build_metadata(str(tmp_path / "images"), str(tmp_path / "metadata.sqlite"))
+
+    con = sqlite3.connect(":memory:")
+    con.executescript(SCHEMA)
+    with HashLoader(con) as loader:
+        # Two printings of Forest: the id comes from each image, not from the name
+        loader.add("lea/100.jpg", "Forest", LEA, ["00000000000000ff"] * len(HASH_TYPES))
+        loader.add("lea/101.jpg", "Forest", LEA, ["ffffffffffffffff"] * len(HASH_TYPES))
+        # No id in the file name: the metadata's id for the name and set, else none
+        loader.add("lea/island.jpg", "Island", LEA, ["0f0f0f0f0f0f0f0f"] * len(HASH_TYPES))
+        loader.add("lea/swamp.jpg", "Swamp", LEA, ["f0f0f0f0f0f0f0f0"] * len(HASH_TYPES))
+    writeIndexFile(con, tmp_path / "index.bin", str(tmp_path / "metadata.sqlite"))
+
+    search = HashSearch.from_index_file(tmp_path / "index.bin")
+    ids = {search.top_k(value, "phash", 1)[0].card_id
+           for value in ("00000000000000ff", "ffffffffffffffff")}
+    assert ids == {100, 101}
+    assert search.top_k("0f0f0f0f0f0f0f0f", "phash", 1)[0].card_id == 102
+    assert search.top_k("f0f0f0f0f0f0f0f0", "phash", 1)[0].card_id is None
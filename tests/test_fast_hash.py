@@ -0,0 +1,58 @@
+# coding=utf-8
+from pathlib import Path
+
+import imagehash
+import numpy as np
+import pytest
+from PIL import Image
+
+from art_crops import HASH_ART_BOX, normalized_card
+from fast_hash import multi_hash, multi_hash_batch, multi_hash_hex, to_hex
+
+SAMPLES = sorted((Path(__file__).resolve().parent.parent / "samples").glob("5272*.jpg"))
+IMAGEHASH_FUNCTIONS = (imagehash.average_hash, imagehash.phash, imagehash.phash_simple,
+                       imagehash.dhash, imagehash.dhash_vertical, imagehash.whash)
+
+
+def imagehash_hex(image):
+    return tuple(str(f(image)) for f in IMAGEHASH_FUNCTIONS)
+
+
+def crops():
+    """Art crops of the sample cards, plus random noise of the art crop size and of odd sizes."""
+    rng = np.random.default_rng(0)
+    images = [normalized_card(Image.open(p).convert("L")).crop(HASH_ART_BOX) for p in SAMPLES]
+    width, height = images[0].size if images else (170, 113)
+    images += [Image.fromarray(rng.integers(0, 256, size=(height, width), dtype=np.uint8)) for _ in range(4)]
+    return images
+
+
+@pytest.mark.parametrize("size", [(170, 113), (37, 91), (8, 8), (300, 17)])
+def test_multi_hash_matches_imagehash_on_noise(size):
+    rng = np.random.default_rng(size[0] * size[1])
+    image = Image.fromarray(rng.integers(0, 256, size=size[::-1], dtype=np.uint8))
+    assert multi_hash_hex(image) == imagehash_hex(image)
+
+
+def test_multi_hash_matches_imagehash_on_art_crops():
+    for image in crops():
+        assert multi_hash_hex(image) == imagehash_hex(image)
+
+
+def test_multi_hash_converts_colour_images():
+    image = Image.fromarray(np.random.default_rng(1).integers(0, 256, size=(113, 170, 3), dtype=np.uint8))
+    assert multi_hash_hex(image) == imagehash_hex(image.convert("L"))
+
+
+def test_batch_matches_single_image():
+    images = crops()
+    batch = multi_hash_batch(np.stack([np.asarray(image) for image in images]))
+    assert batch.shape == (len(images), 6) and batch.dtype == np.uint64
+    for row, image in zip(batch, images):
+        assert tuple(map(to_hex, row)) == tuple(map(to_hex, multi_hash(image)))
+
+
+def test_batch_rejects_a_single_crop_and_accepts_none():
+    with pytest.raises(ValueError):
+        multi_hash_batch(np.zeros((113, 170), dtype=np.uint8))
+    assert multi_hash_batch(np.zeros((0, 113, 170), dtype=np.uint8)).shape == (0, 6)
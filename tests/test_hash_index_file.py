@@ -0,0 +1,80 @@
+# coding=utf-8
+import numpy as np
+import pytest
+
+from hash_index_file import HEADER, HashIndexFile, write_index_file
+from hash_search import HASH_TYPES, HashSearch
+
+NAMES = [("Forest", "Limited Edition Alpha"), ("Forest", "Limited Edition Alpha"),
+         ("Jötun Grunt", "Coldsnap"), ("Fire // Ice", "Apocalypse")]
+
+
+def columns(count=len(NAMES)):
+    rng = np.random.default_rng(0)
+    return {t: rng.integers(0, 2**64, size=count, dtype=np.uint64) for t in HASH_TYPES}
+
+
+def version(path):
+    with open(path, "rb") as f:
+        return HEADER.unpack(f.read(HEADER.size))[1]
+
+
+def test_version_1_round_trip(tmp_path):
+    path = tmp_path / "index.bin"
+    hashes = columns()
+    write_index_file(path, hashes, NAMES, card_ids=[288, 289, -1, 27165])
+    index = HashIndexFile(path, verify=True)
+    assert version(path) == 1 and index.orientations is None
+    assert index.hash_types == list(HASH_TYPES)
+    for t in HASH_TYPES:
+        np.testing.assert_array_equal(index.columns[t], hashes[t])
+    assert [index.names[i] for i in range(len(index))] == NAMES
+    assert list(index.card_ids) == [288, 289, -1, 27165]
+
+
+def test_version_2_round_trip_with_orientations(tmp_path):
+    path = tmp_path / "index.bin"
+    write_index_file(path, columns(), NAMES, orientations=[0, 90, 180, 270])
+    index = HashIndexFile(path, verify=True)
+    assert version(path) == 2
+    assert list(index.orientations) == [0, 90, 180, 270]
+    assert [index.names[i] for i in range(len(index))] == NAMES
+
+
+def test_rows_without_card_ids_are_reported_as_none(tmp_path):
+    path = tmp_path / "index.bin"
+    write_index_file(path, columns(), NAMES)
+    assert list(HashIndexFile(path).card_ids) == [-1] * len(NAMES)
+    search = HashSearch.from_index_file(path)
+    assert {match.card_id for match in search.top_k(search.column("phash")[0], "phash", len(NAMES))} == {None}
+
+
+def test_empty_index(tmp_path):
+    path = tmp_path / "index.bin"
+    write_index_file(path, columns(0), [])
+    assert len(HashIndexFile(path, verify=True)) == 0
+
+
+def test_corrupted_payload_fails_verify(tmp_path):
+    path = tmp_path / "index.bin"
+    write_index_file(path, columns(), NAMES)
+    data = bytearray(path.read_bytes())
+    data[-3] ^= 0xFF
+    path.write_bytes(bytes(data))
+    HashIndexFile(path)
+    with pytest.raises(ValueError, match="checksum"):
+        HashIndexFile(path, verify=True)
+
+
+@pytest.mark.parametrize("damage, message", [
+    (lambda data: data[:-1], "truncated"),
+    (lambda data: b"NOTANIDX" + data[8:], "not a hash index file"),
+    (lambda data: data[:8] + (99).to_bytes(4, "little") + data[12:], "version 99"),
+    (lambda data: data[:10], "too small"),
+])
+def test_damaged_files_are_rejected(tmp_path, damage, message):
+    path = tmp_path / "index.bin"
+    write_index_file(path, columns(), NAMES)
+    path.write_bytes(damage(path.read_bytes()))
+    with pytest.raises(ValueError, match=message):
+        HashIndexFile(path)
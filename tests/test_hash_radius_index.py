@@ -0,0 +1,59 @@
+# coding=utf-8
+import numpy as np
+import pytest
+
+from hash_radius_index import MultiIndexHash
+from hash_search import popcount
+
+
+def flip_bits(value, count, rng):
+    """value with count distinct random bits flipped."""
+    mask = 0
+    for bit in rng.choice(64, count, replace=False):
+        mask |= 1 << int(bit)
+    return np.uint64(int(value) ^ mask)
+
+
+@pytest.fixture(scope="module")
+def table():
+    """Random hashes with near copies of the first ones, so every radius has neighbours."""
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 2**64, size=5000, dtype=np.uint64)
+    near = [flip_bits(hashes[i % 20], 1 + i % 24, rng) for i in range(400)]
+    # Duplicates too
+    return np.concatenate([hashes, near, hashes[:10]])
+
+
+def linear_scan(hashes, query, radius):
+    distances = popcount(hashes ^ query)
+    rows = np.flatnonzero(distances <= radius)
+    order = np.lexsort((rows, distances[rows]))
+    return rows[order], distances[rows][order]
+
+
+@pytest.mark.parametrize("radius", [0, 1, 3, 4, 7, 8, 12, 16, 19, 20, 24, 32])
+def test_within_matches_linear_scan(table, radius):
+    index = MultiIndexHash(table)
+    rng = np.random.default_rng(radius)
+    queries = [table[0], table[7], flip_bits(table[3], 5, rng), rng.integers(0, 2**64, dtype=np.uint64)]
+    for query in queries:
+        rows, distances = index.within(query, radius)
+        expected_rows, expected_distances = linear_scan(table, query, radius)
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_array_equal(distances, expected_distances)
+
+
+def test_within_accepts_hex_queries(table):
+    index = MultiIndexHash(table)
+    rows, _ = index.within(f"{int(table[5]):016x}", 0)
+    assert 5 in rows
+
+
+def test_save_and_load_give_the_same_results(table, tmp_path):
+    index = MultiIndexHash(table)
+    path = tmp_path / "phash.npz"
+    index.save(path)
+    loaded = MultiIndexHash.load(path)
+    np.testing.assert_array_equal(loaded.hashes, index.hashes)
+    for a, b in zip(loaded.within(table[2], 10), index.within(table[2], 10)):
+        np.testing.assert_array_equal(a, b)
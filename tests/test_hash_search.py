@@ -0,0 +1,27 @@
+# coding=utf-8
+import sqlite3
+
+from hash_loader import HashLoader
+from hash_search import HASH_TYPES, HashSearch
+
+SCHEMA = """
+create table binaryhashes(path text, name text, "set" text, ahash text, phash text, psimplehash text,
+                          dhash text, vertdhash text, whash text);
+create table hashes(path text, name text, "set" text, ahash blob, phash blob, psimplehash blob,
+                    dhash blob, vertdhash blob, whash blob);
+"""
+
+
+def test_from_db_reads_sqlite():
+    con = sqlite3.connect(":memory:")
+    con.executescript(SCHEMA)
+    with HashLoader(con, batch_size=2) as loader:
+        loader.add("lea/1.jpg", "Forest", "Limited Edition Alpha", ["00000000000000ff"] * len(HASH_TYPES))
+        loader.add("lea/2.jpg", "Forest", "Limited Edition Alpha", ["ffffffffffffffff"] * len(HASH_TYPES))
+        loader.add("lea/3.jpg", "Island", "Limited Edition Alpha", ["0f0f0f0f0f0f0f0f"] * len(HASH_TYPES))
+    search = HashSearch.from_db(con.cursor())
+    assert len(search) == 3
+    assert sorted(search.names[i] for i in range(3)) == \
+        [("Forest", "Limited Edition Alpha")] * 2 + [("Island", "Limited Edition Alpha")]
+    best = search.top_k("0f0f0f0f0f0f0f0f", "phash", 1)[0]
+    assert (best.distance, best.name) == (0, "Island")
@@ -0,0 +1,49 @@
+# coding=utf-8
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from hash_search import HASH_TYPES, HashSearch
+from identify_server import Identifier, make_server
+
+
+@pytest.fixture
+def server():
+    search = HashSearch.from_rows([("Forest", "Limited Edition Alpha", *["00000000000000ff"] * len(HASH_TYPES)),
+                                   ("Island", "Limited Edition Alpha", *["0f0f0f0f0f0f0f0f"] * len(HASH_TYPES))])
+    server = make_server(Identifier(search), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8")
+
+
+def test_identify_hash(server):
+    request = urllib.request.Request(f"{server}/identify/hash?k=1", method="POST",
+                                     data=json.dumps({"hash": "0f0f0f0f0f0f0f0f"}).encode("utf-8"))
+    with urllib.request.urlopen(request) as response:
+        matches = json.load(response)["matches"]
+    assert [(m["name"], m["distance"]) for m in matches] == [("Island", 0)]
+
+
+def test_unknown_paths_share_one_metric_label(server):
+    assert get(f"{server}/health")[0] == 200
+    for path in ("/nope", "/wp-login.php", "/identify/other"):
+        assert get(server + path)[0] == 404
+    status, metrics = get(f"{server}/metrics")
+    assert status == 200
+    assert 'identify_responses_total{endpoint="/health",status="200"} 1' in metrics
+    assert 'identify_responses_total{endpoint="other",status="404"} 3' in metrics
+    assert "nope" not in metrics and "wp-login" not in metrics
@@ -0,0 +1,51 @@
+# coding=utf-8
+import asyncio
+
+from image_scraper import Scraper
+from scryfall_stub import ScryfallStub, card
+
+
+def test_slow_host_does_not_hold_connection_slots():
+    async def main():
+        async with ScryfallStub([card(100)]) as stub:
+            slow_url = stub.url.replace("127.0.0.1", "localhost")
+            scraper = Scraper(concurrency=2, host_rates={"localhost": 2.0, "127.0.0.1": 0})
+            async with scraper:
+                loop = asyncio.get_running_loop()
+                slow = [asyncio.ensure_future(scraper.request("GET", f"{slow_url}/cards/multiverse/100", "json"))
+                        for _ in range(6)]
+                await asyncio.sleep(0.05)
+                start = loop.time()
+                fast = await scraper.request("GET", f"{stub.url}/cards/multiverse/100", "json")
+                seconds = loop.time() - start
+                for task in slow:
+                    task.cancel()
+                await asyncio.gather(*slow, return_exceptions=True)
+                return fast, seconds
+
+    fast, seconds = asyncio.run(main())
+    assert fast["name"] == "Card 100"
+    # Five slow requests are still waiting for their host's slots, 0.5 s apart
+    assert seconds < 0.4
+
+
+def test_requests_stay_spaced_when_connection_slots_are_contended():
+    rate = 10.0
+
+    async def main():
+        async with ScryfallStub([card(100)], delay=0.5) as slow, ScryfallStub([card(100)]) as fast:
+            slow_url = slow.url.replace("127.0.0.1", "localhost")
+            scraper = Scraper(concurrency=2, host_rates={"localhost": 0, "127.0.0.1": rate})
+            async with scraper:
+                # Both connection slots stay busy while the fast host's slots pass
+                busy = [asyncio.ensure_future(scraper.request("GET", f"{slow_url}/cards/multiverse/100", "json"))
+                        for _ in range(2)]
+                await asyncio.sleep(0.05)
+                await asyncio.gather(*(scraper.request("GET", f"{fast.url}/cards/multiverse/100", "json")
+                                       for _ in range(5)))
+                await asyncio.gather(*busy)
+            return sorted(t for t, _, _, _ in fast.requests)
+
+    times = asyncio.run(main())
+    assert len(times) == 5
+    assert min(b - a for a, b in zip(times, times[1:])) >= 0.75 / rate
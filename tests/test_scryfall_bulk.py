@@ -0,0 +1,65 @@
+# coding=utf-8
+import gzip
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from scryfall_bulk import BulkIndex, build_index, iter_cards
+
+FIXTURE = Path(__file__).parent / "fixtures" / "bulk_cards.json"
+
+
+def fixture_cards():
+    with open(FIXTURE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, 1 << 20])
+def test_iter_cards_across_chunk_boundaries(chunk_size):
+    assert list(iter_cards(FIXTURE, chunk_size)) == fixture_cards()
+
+
+def test_iter_cards_reads_gzip(tmp_path):
+    path = tmp_path / "default-cards.json.gz"
+    with open(FIXTURE, "rb") as src, gzip.open(path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    assert list(iter_cards(path, 16)) == fixture_cards()
+
+
+def test_iter_cards_empty_array(tmp_path):
+    path = tmp_path / "empty.json"
+    path.write_text("[]\n")
+    assert list(iter_cards(path)) == []
+
+
+@pytest.mark.parametrize("cut", ["mid_object", "between_objects"])
+def test_truncated_file_raises(tmp_path, cut):
+    text = FIXTURE.read_text(encoding="utf-8")
+    end = text.index("},\n") + 1
+    path = tmp_path / "truncated.json"
+    path.write_text(text[:end - 20] if cut == "mid_object" else text[:end + 1], encoding="utf-8")
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_cards(path, 16))
+
+
+@pytest.fixture
+def index(tmp_path):
+    out = str(tmp_path / "bulk.sqlite")
+    # Four multiverse ids: one single-id card, two for the split card, one more
+    assert build_index(FIXTURE, out, batch_size=2) == 4
+    return BulkIndex(out)
+
+
+def test_index_keys_every_multiverse_id(index):
+    cards = {card["id"]: card for card in fixture_cards()}
+    assert len(index) == 4
+    assert index.card(288) == cards["a1b2c3d4-0001"]
+    assert index.card(27165) == index.card(27166) == cards["a1b2c3d4-0002"]
+    assert index.card("121268")["name"] == "Jötun Grunt"
+
+
+def test_index_skips_cards_without_multiverse_ids(index):
+    assert index.card(0) is None
+    assert index.card(999999) is None
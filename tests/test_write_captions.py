@@ -0,0 +1,123 @@
+# coding=utf-8
+import asyncio
+import json
+
+from image_scraper import Scraper
+from scryfall_stub import ScryfallStub, card
+from write_captions import ScryfallClient
+
+CARDS = [card(100), card(101), card(102), card(103), card(104, "Forest")]
+RATE = 10.0
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def single_card_scraper(stub, **kwargs):
+    """A Scraper rate limited to RATE on the stub, its client requesting one card at a time."""
+    return Scraper(host_rates={"127.0.0.1": RATE}, scryfall_url=stub.url, metadata_batch=1, **kwargs)
+
+
+def test_requests_are_spaced_by_the_host_rate():
+    async def main():
+        async with ScryfallStub(CARDS) as stub:
+            async with single_card_scraper(stub) as scraper:
+                cards = await asyncio.gather(*(scraper.scryfall.card(i) for i in range(100, 105)))
+            return cards, stub.requests
+
+    cards, requests = run(main())
+    assert [c["name"] for c in cards] == [f"Card {i}" for i in range(100, 104)] + ["Forest"]
+    assert [method for _, method, _, _ in requests] == ["GET"] * 5
+    times = sorted(t for t, _, _, _ in requests)
+    # Arrival times also carry connection setup, hence the slack
+    assert min(b - a for a, b in zip(times, times[1:])) >= 0.75 / RATE
+
+
+def test_missing_card_is_none_and_writes_no_sidecar(tmp_path):
+    async def main():
+        async with ScryfallStub(CARDS) as stub:
+            async with single_card_scraper(stub) as scraper:
+                return (await scraper.scryfall.card(999),
+                        await scraper.scryfall.save_metadata(999, tmp_path / "999.jpg"))
+
+    assert run(main()) == (None, False)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_error_object_is_none():
+    async def request(method, url, kind, **kwargs):
+        return {"object": "error", "code": "bad_request", "status": 400, "details": "Bad id"}
+
+    assert run(ScryfallClient(request, "http://stub", flush_size=1).card(100)) is None
+
+
+def test_save_metadata_writes_the_sidecar_next_to_the_image(tmp_path):
+    async def main():
+        async with ScryfallStub(CARDS) as stub:
+            async with single_card_scraper(stub) as scraper:
+                return await scraper.scryfall.save_metadata(104, tmp_path / "104.jpg")
+
+    assert run(main()) is True
+    with open(tmp_path / "104.json", encoding="utf-8") as f:
+        assert json.load(f) == card(104, "Forest")
+
+
+def batched(ids, flush_size=75, flush_interval=10.0):
+    """Cards of concurrent card() calls for ids, with the stub's requests and the seconds they took."""
+    async def main():
+        async with ScryfallStub(CARDS) as stub:
+            scraper = Scraper(host_rates={"127.0.0.1": 0}, scryfall_url=stub.url, metadata_batch=flush_size,
+                              metadata_interval=flush_interval)
+            async with scraper:
+                start = asyncio.get_running_loop().time()
+                cards = await asyncio.wait_for(asyncio.gather(*(scraper.scryfall.card(i) for i in ids)), 5)
+                return cards, stub.requests, asyncio.get_running_loop().time() - start
+
+    return run(main())
+
+
+def test_batch_is_sent_once_flush_size_ids_wait():
+    cards, requests, seconds = batched([100, 101, 102, 103, 104], flush_size=5)
+    assert [c["name"] for c in cards] == [f"Card {i}" for i in range(100, 104)] + ["Forest"]
+    assert [(method, path, ids) for _, method, path, ids in requests] == \
+        [("POST", "/cards/collection", [100, 101, 102, 103, 104])]
+    # Well before the flush timer
+    assert seconds < 1.0
+
+
+def test_batches_never_exceed_flush_size():
+    cards, requests, _ = batched([100, 101, 102, 103, 104], flush_size=2, flush_interval=0.1)
+    assert [c["name"] for c in cards[:4]] == [f"Card {i}" for i in range(100, 104)]
+    assert sorted(ids for _, _, _, ids in requests) == [[100, 101], [102, 103], [104]]
+
+
+def test_partial_batch_is_sent_on_the_timer():
+    cards, requests, seconds = batched([100, 101], flush_interval=0.2)
+    assert [c["name"] for c in cards] == ["Card 100", "Card 101"]
+    assert [ids for _, _, _, ids in requests] == [[100, 101]]
+    assert 0.2 <= seconds < 1.0
+
+
+def test_duplicate_ids_wait_on_one_request():
+    cards, requests, _ = batched([100, 100, 101, 100], flush_interval=0.05)
+    assert [c["name"] for c in cards] == ["Card 100", "Card 100", "Card 101", "Card 100"]
+    assert [ids for _, _, _, ids in requests] == [[100, 101]]
+
+
+def test_not_found_ids_resolve_to_none():
+    cards, requests, _ = batched([100, 999, 104], flush_interval=0.05)
+    assert cards[0]["name"] == "Card 100" and cards[2]["name"] == "Forest"
+    assert cards[1] is None
+    assert [ids for _, _, _, ids in requests] == [[100, 999, 104]]
+
+
+def test_failed_collection_request_resolves_every_caller():
+    async def request(method, url, kind, **kwargs):
+        return None
+
+    async def main():
+        client = ScryfallClient(request, "http://stub", flush_interval=0.01)
+        return await asyncio.wait_for(asyncio.gather(client.card(100), client.card(101)), 5)
+
+    assert run(main()) == [None, None]